@@ -1,26 +1,63 @@
 """Classes for files."""
 
-import os
+from __future__ import annotations
 
-from typing import List, Optional, Union
+import hashlib
+import importlib
+import os
 
-from cyberfusion.Common import get_tmp_file
-from cyberfusion.QueueSupport import Queue
-from cyberfusion.QueueSupport.items.command import CommandItem
-from cyberfusion.QueueSupport.items.copy import CopyItem
-from cyberfusion.QueueSupport.items.unlink import UnlinkItem
+from typing import TYPE_CHECKING, Any, List, Optional, Union
 
-from cyberfusion.FileSupport.encryption import (
-    EncryptionProperties,
-    encrypt_file,
-    decrypt_file,
+from cyberfusion.FileSupport.diff import (
+    CONTEXT_LINES,
+    MAX_INPUT_SIZE,
+    MAX_OUTPUT_LINES,
+    get_differences,
 )
-from cyberfusion.FileSupport.exceptions import DecryptionError
+from cyberfusion.FileSupport.exceptions import DecryptionError, NotMaterializedError
+
+# Many users are short-lived scripts that write a file or two. Importing
+# QueueSupport (which imports SQLAlchemy), Common, the encryption module and
+# asyncio takes a multiple of the time this module takes on its own. Therefore,
+# they are imported where used, and only for type checking here.
+
+if TYPE_CHECKING:  # pragma: no cover
+    from cyberfusion.QueueSupport import Queue
+    from cyberfusion.QueueSupport.items import _Item
+    from cyberfusion.QueueSupport.items.copy import CopyItem
+
+    from cyberfusion.FileSupport.encryption import (
+        EncryptionProperties as EncryptionProperties,
+        decrypt_file as decrypt_file,
+        encrypt_file as encrypt_file,
+    )
+    from cyberfusion.FileSupport.scheduler import CommandScheduler
+
+_LAZY_ATTRIBUTES = {
+    "EncryptionProperties": "cyberfusion.FileSupport.encryption",
+    "decrypt_file": "cyberfusion.FileSupport.encryption",
+    "encrypt_file": "cyberfusion.FileSupport.encryption",
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Get attributes that are imported lazily."""
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+
+
+def _get_digest(contents: str) -> bytes:
+    """Get digest of contents."""
+    return hashlib.sha256(contents.encode()).digest()
 
 
 class _DestinationFile:
     """Represents destination file."""
 
+    __slots__ = ("path", "encryption_properties")
+
     def __init__(
         self, *, path: str, encryption_properties: Optional[EncryptionProperties] = None
     ) -> None:
@@ -37,8 +74,23 @@ class _DestinationFile:
         """Get if exists."""
         return os.path.exists(self.path)
 
+    def read(self) -> Optional[str]:
+        """Read file.
+
+        Bytes that cannot be decoded are replaced, as the contents are only
+        used to show differences. Line endings are not translated, so that
+        changes to them are shown.
+        """
+        if not self._exists:
+            return None
+
+        with open(self.path, "r", errors="replace", newline="") as f:
+            return f.read()
+
     def decrypt(self) -> Optional[str]:
         """Decrypt file."""
+        from cyberfusion.FileSupport.encryption import decrypt_file
+
         if not self._exists or not self.encryption_properties:
             return None
 
@@ -49,10 +101,64 @@ class _DestinationFile:
                 f"Decrypting the destination file at '{self.path}' failed. Note that the file must already be encrypted using the specified encryption properties."
             ) from e
 
+    async def async_decrypt(self) -> Optional[str]:
+        """Decrypt file without blocking the event loop."""
+        import asyncio
+
+        from cyberfusion.FileSupport.encryption import async_decrypt_file
+
+        if not self.encryption_properties or not await asyncio.to_thread(
+            os.path.exists, self.path
+        ):
+            return None
+
+        try:
+            return await async_decrypt_file(self.encryption_properties, self.path)
+        except DecryptionError as e:
+            raise DecryptionError(
+                f"Decrypting the destination file at '{self.path}' failed. Note that the file must already be encrypted using the specified encryption properties."
+            ) from e
+
+    def compare(self, contents: str) -> bool:
+        """Get if decrypted file is equal to contents.
+
+        Unlike comparing to the result of 'decrypt', this stops decrypting at the
+        first difference, if the encryption format allows.
+        """
+        from cyberfusion.FileSupport.encryption import compare_file
+
+        if not self._exists or not self.encryption_properties:
+            return False
+
+        try:
+            return compare_file(self.encryption_properties, self.path, contents)
+        except DecryptionError as e:
+            raise DecryptionError(
+                f"Decrypting the destination file at '{self.path}' failed. Note that the file must already be encrypted using the specified encryption properties."
+            ) from e
+
 
 class DestinationFileReplacement:
     """Represents file that will replace destination file."""
 
+    # Plans can consist of many replacements, so keep the size of every single
+    # one small. Without slots, every replacement has its own attribute dict.
+
+    __slots__ = (
+        "queue",
+        "_contents",
+        "_contents_digest",
+        "default_comment_character",
+        "command",
+        "command_scheduler",
+        "reference",
+        "delta",
+        "retain_contents",
+        "tmp_path",
+        "destination_file",
+        "materialized",
+    )
+
     def __init__(
         self,
         queue: Queue,
@@ -63,6 +169,10 @@ class DestinationFileReplacement:
         command: Optional[List[str]] = None,
         reference: Optional[str] = None,
         encryption_properties: Optional[EncryptionProperties] = None,
+        delta: bool = False,
+        retain_contents: bool = True,
+        materialize: bool = True,
+        command_scheduler: Optional[CommandScheduler] = None,
     ) -> None:
         """Set attributes.
 
@@ -70,31 +180,115 @@ class DestinationFileReplacement:
 
         If 'encryption_properties' is specified, and the destination file already
         exists, it must be encrypted using the same properties (it is decrypted).
+
+        If 'delta' is True, only blocks of the destination file that changed are
+        written (see DeltaCopyItem). For encrypted files, this only has effect
+        with the chunked format: with other formats, encrypting the same contents
+        twice results in different bytes.
+
+        If 'retain_contents' is False, contents are not kept in memory once
+        written to the tmp file. When needed later, they are read from the tmp
+        file. Use this when planning many replacements at once.
+
+        If 'materialize' is False, the tmp file is created empty, and contents
+        are not written to it until 'materialize' or 'async_materialize' is
+        called. Until then, checking for changes, getting differences and
+        adding to the queue raise NotMaterializedError.
+
+        If 'command_scheduler' is specified, 'command' is added to it instead of
+        to the queue (see CommandScheduler).
         """
+        from cyberfusion.Common import get_tmp_file
+
         self.queue = queue
-        self._contents = contents
         self.default_comment_character = default_comment_character
         self.command = command
+        self.command_scheduler = command_scheduler
         self.reference = reference
-        self.encryption_properties = encryption_properties
+        self.delta = delta
+        self.retain_contents = retain_contents
+
+        self._contents: Optional[str] = self._render_contents(contents)
+        self._contents_digest = _get_digest(self._contents)
 
         self.tmp_path = get_tmp_file()
         self.destination_file = _DestinationFile(
             path=destination_file_path, encryption_properties=encryption_properties
         )
+        self.materialized = False
+
+        if materialize:
+            self.materialize()
+
+    @classmethod
+    async def async_create(
+        cls, queue: Queue, **kwargs: Any
+    ) -> DestinationFileReplacement:
+        """Create replacement without blocking the event loop.
+
+        Takes the same arguments as the constructor, except 'materialize'.
+        """
+        import asyncio
+
+        destination_file_replacement = await asyncio.to_thread(
+            cls, queue, materialize=False, **kwargs
+        )
+
+        await destination_file_replacement.async_materialize()
 
+        return destination_file_replacement
+
+    def materialize(self) -> None:
+        """Write contents to tmp file."""
         self.write_to_file(self.tmp_path)
 
+        self.materialized = True
+
+        if not self.retain_contents:
+            self._contents = None
+
+    def _check_materialized(self) -> None:
+        """Raise if contents were not written to tmp file yet.
+
+        Otherwise, the empty tmp file would be used as if it has the contents,
+        e.g. copied to the destination file.
+        """
+        if not self.materialized:
+            raise NotMaterializedError(
+                f"Contents were not written to the tmp file at '{self.tmp_path}' yet. Call 'materialize' or 'async_materialize' first."
+            )
+
+    async def async_materialize(self) -> None:
+        """Write contents to tmp file without blocking the event loop."""
+        await self.async_write_to_file(self.tmp_path)
+
+        self.materialized = True
+
+        if not self.retain_contents:
+            self._contents = None
+
     @property
-    def contents(self) -> str:
-        """Get contents."""
-        if self._contents != "" and not self._contents.endswith(
-            "\n"
-        ):  # Some programs require EOL
-            self._contents += "\n"
+    def encryption_properties(self) -> Optional[EncryptionProperties]:
+        """Get encryption properties.
+
+        Stored on the destination file only, so that they are not kept twice.
+        """
+        return self.destination_file.encryption_properties
+
+    @encryption_properties.setter
+    def encryption_properties(
+        self, encryption_properties: Optional[EncryptionProperties]
+    ) -> None:
+        """Set encryption properties."""
+        self.destination_file.encryption_properties = encryption_properties
+
+    def _render_contents(self, contents: str) -> str:
+        """Get contents with EOL and default comment."""
+        if contents != "" and not contents.endswith("\n"):  # Some programs require EOL
+            contents += "\n"
 
         if not self.default_comment_character:
-            return self._contents
+            return contents
 
         default_comment = f"{self.default_comment_character} Update this file via your management interface.\n"
         default_comment += (
@@ -102,30 +296,96 @@ class DestinationFileReplacement:
         )
         default_comment += "\n"
 
-        return default_comment + self._contents
+        return default_comment + contents
+
+    @property
+    def contents(self) -> str:
+        """Get contents.
+
+        If contents are not retained, they are read from the tmp file.
+        """
+        from cyberfusion.FileSupport.encryption import decrypt_file
+
+        if self._contents is not None:
+            return self._contents
+
+        if self.encryption_properties:
+            return decrypt_file(self.encryption_properties, self.tmp_path)
+
+        with open(self.tmp_path, "r", newline="") as f:
+            return f.read()
+
+    async def _async_get_contents(self) -> str:
+        """Get contents without blocking the event loop.
+
+        If contents are not retained, reading (and decrypting) them blocks, so
+        this is done in a thread.
+        """
+        import asyncio
+
+        if self._contents is not None:
+            return self._contents
+
+        return await asyncio.to_thread(lambda: self.contents)
+
+    @staticmethod
+    def _write(path: str, contents: Union[str, bytes]) -> None:
+        """Write encrypted (bytes) or unencrypted (string) contents to file."""
+        open_mode = "wb" if isinstance(contents, bytes) else "w"
+
+        with open(path, open_mode) as f:
+            f.write(contents)
 
     def write_to_file(self, path: str) -> None:
         """Write contents to file."""
+        from cyberfusion.FileSupport.encryption import encrypt_file
+
         contents: Union[str, bytes]
 
         if self.encryption_properties:
-            open_mode = "wb"
-
             contents = encrypt_file(
                 self.encryption_properties,
                 self.contents,
+                previous_path=self.destination_file.path,
             )
         else:
-            open_mode = "w"
-
             contents = self.contents
 
-        with open(path, open_mode) as f:
-            f.write(contents)
+        self._write(path, contents)
+
+    async def async_write_to_file(self, path: str) -> None:
+        """Write contents to file without blocking the event loop."""
+        import asyncio
+
+        from cyberfusion.FileSupport.encryption import async_encrypt_file
+
+        contents: Union[str, bytes]
+
+        if self.encryption_properties:
+            contents = await async_encrypt_file(
+                self.encryption_properties,
+                await self._async_get_contents(),
+                previous_path=self.destination_file.path,
+            )
+        else:
+            contents = await self._async_get_contents()
+
+        await asyncio.to_thread(self._write, path, contents)
 
     @property
     def _copy_item(self) -> CopyItem:
         """Get copy item."""
+        from cyberfusion.QueueSupport.items.copy import CopyItem
+
+        from cyberfusion.FileSupport.items import DeltaCopyItem
+
+        if self.delta:
+            return DeltaCopyItem(
+                source=self.tmp_path,
+                destination=self.destination_file.path,
+                reference=self.reference,
+            )
+
         return CopyItem(
             source=self.tmp_path,
             destination=self.destination_file.path,
@@ -135,23 +395,101 @@ class DestinationFileReplacement:
     @property
     def changed(self) -> bool:
         """Check if the destination file content has changed."""
+        from cyberfusion.FileSupport.encryption import FileFormatEnum
+
+        self._check_materialized()
+
         if self.encryption_properties:
+            if self.encryption_properties.file_format == FileFormatEnum.CHUNKED:
+                return not self.destination_file.compare(self.contents)
+
             decrypted_contents = self.destination_file.decrypt()
 
-            return decrypted_contents != self.contents
+            if decrypted_contents is None:
+                return True
+
+            # Compare digests, so that contents that are not retained don't
+            # have to be read.
+
+            return _get_digest(decrypted_contents) != self._contents_digest
 
         return bool(self._copy_item.outcomes)
 
-    def add_to_queue(self) -> None:
-        """Add items for replacement to queue."""
-        add_copy_item = True
+    async def async_changed(self) -> bool:
+        """Check if the destination file content has changed, without blocking the event loop."""
+        import asyncio
 
-        # If encrypted, only add CopyItem when unencrypted contents changed.
-        # CopyItem does not account for encryption, so without this check the
-        # file would always be copied.
+        from cyberfusion.FileSupport.encryption import FileFormatEnum
+
+        self._check_materialized()
 
         if self.encryption_properties:
-            add_copy_item = self.changed
+            if self.encryption_properties.file_format == FileFormatEnum.CHUNKED:
+                return not await asyncio.to_thread(
+                    lambda: self.destination_file.compare(self.contents)
+                )
+
+            decrypted_contents = await self.destination_file.async_decrypt()
+
+            if decrypted_contents is None:
+                return True
+
+            return _get_digest(decrypted_contents) != self._contents_digest
+
+        return await asyncio.to_thread(lambda: bool(self._copy_item.outcomes))
+
+    def get_differences(
+        self,
+        *,
+        context_lines: int = CONTEXT_LINES,
+        max_input_size: int = MAX_INPUT_SIZE,
+        max_output_lines: int = MAX_OUTPUT_LINES,
+    ) -> List[str]:
+        """Get differences between destination file and contents.
+
+        If encrypted, the decrypted destination file is compared. See
+        'get_differences' in the 'diff' module for the limits.
+        """
+        self._check_materialized()
+
+        # Don't read (or decrypt) file only to find out that it is too large.
+        # For encrypted files, the size of the encrypted file is an upper bound
+        # on the size of the contents.
+
+        if (
+            self.destination_file._exists
+            and os.path.getsize(self.destination_file.path) > max_input_size
+        ):
+            return [
+                f"Differences between {self.destination_file.path} and {self.tmp_path} not shown, as their size exceeds {max_input_size} characters."
+            ]
+
+        if self.encryption_properties:
+            destination_contents = self.destination_file.decrypt()
+        else:
+            destination_contents = self.destination_file.read()
+
+        return get_differences(
+            destination_contents or "",
+            self.contents,
+            fromfile=self.destination_file.path,
+            tofile=self.tmp_path,
+            context_lines=context_lines,
+            max_input_size=max_input_size,
+            max_output_lines=max_output_lines,
+        )
+
+    @property
+    def differences(self) -> List[str]:
+        """Get differences between destination file and contents."""
+        return self.get_differences()
+
+    def _get_items(self, add_copy_item: bool) -> List[_Item]:
+        """Get items for replacement."""
+        from cyberfusion.QueueSupport.items.command import CommandItem
+        from cyberfusion.QueueSupport.items.unlink import UnlinkItem
+
+        items: List[_Item] = []
 
         # Copy and unlink instead of move. MoveItem copies metadata (which
         # means mode etc. of destination file is incorrect, as set to the tmp
@@ -162,17 +500,66 @@ class DestinationFileReplacement:
         if add_copy_item:
             copy_item = self._copy_item
 
-            self.queue.add(copy_item)
+            items.append(copy_item)
 
             if self.command and copy_item.outcomes:
-                self.queue.add(
-                    CommandItem(command=self.command, reference=self.reference),
-                )
-
-        self.queue.add(
+                if self.command_scheduler:
+                    self.command_scheduler.add(self.command, reference=self.reference)
+                else:
+                    items.append(
+                        CommandItem(command=self.command, reference=self.reference),
+                    )
+
+        items.append(
             UnlinkItem(
                 path=self.tmp_path,
                 hide_outcomes=True,
                 reference=self.reference,
             ),
         )
+
+        return items
+
+    def add_to_queue(self) -> None:
+        """Add items for replacement to queue.
+
+        May be called from multiple threads for the same queue: items of every
+        replacement are added atomically (see 'add_items_to_queue'). The order
+        of replacements added by different threads is the order in which they
+        finish determining their items.
+        """
+        from cyberfusion.FileSupport.utilities import add_items_to_queue
+
+        self._check_materialized()
+
+        add_copy_item = True
+
+        # If encrypted, only add CopyItem when unencrypted contents changed.
+        # CopyItem does not account for encryption, so without this check the
+        # file would always be copied.
+
+        if self.encryption_properties:
+            add_copy_item = self.changed
+
+        add_items_to_queue(self.queue, self._get_items(add_copy_item))
+
+    async def async_add_to_queue(self) -> None:
+        """Add items for replacement to queue without blocking the event loop.
+
+        Items are determined (which reads files) in a thread, and added to the
+        queue atomically, like 'add_to_queue'.
+        """
+        import asyncio
+
+        from cyberfusion.FileSupport.utilities import add_items_to_queue
+
+        self._check_materialized()
+
+        add_copy_item = True
+
+        if self.encryption_properties:
+            add_copy_item = await self.async_changed()
+
+        add_items_to_queue(
+            self.queue, await asyncio.to_thread(self._get_items, add_copy_item)
+        )
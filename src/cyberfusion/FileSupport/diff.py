@@ -0,0 +1,300 @@
+"""Utilities for differences between contents."""
+
+import bisect
+from typing import Dict, List, Tuple
+
+CONTEXT_LINES = 3
+MAX_INPUT_SIZE = 16 * 1024 * 1024
+MAX_OUTPUT_LINES = 10_000
+
+# Regions without unique lines in common are compared using difflib when the
+# product of their sizes is at most this, as difflib's cost grows with that
+# product. Larger regions are shown as replaced.
+
+SMALL_REGION_SIZE = 10_000
+
+# Amount of lines that may be walked while looking for matching lines, per
+# line of input. When exhausted, remaining regions are shown as replaced. This
+# keeps the cost linear in the amount of lines, even for input on which the
+# patience diff would recurse deeply.
+
+WORK_FACTOR = 16
+
+NO_NEWLINE_MARKER = "\\ No newline at end of file"
+
+_MatchingBlock = Tuple[int, int, int]
+_Change = Tuple[int, int, int, int]
+
+
+def _get_anchors(
+    a: List[int], alo: int, ahi: int, b: List[int], blo: int, bhi: int
+) -> List[Tuple[int, int]]:
+    """Get longest increasing sequence of lines unique to both regions.
+
+    This is the 'patience' part of the patience diff.
+    """
+    a_counts: Dict[int, int] = {}
+    a_indexes: Dict[int, int] = {}
+    b_counts: Dict[int, int] = {}
+
+    for i in range(alo, ahi):
+        a_counts[a[i]] = a_counts.get(a[i], 0) + 1
+        a_indexes[a[i]] = i
+
+    for j in range(blo, bhi):
+        b_counts[b[j]] = b_counts.get(b[j], 0) + 1
+
+    pairs = [
+        (a_indexes[b[j]], j)
+        for j in range(blo, bhi)
+        if b_counts[b[j]] == 1 and a_counts.get(b[j]) == 1
+    ]
+
+    tails: List[int] = []
+    tail_positions: List[int] = []
+    previous_positions: List[int] = []
+
+    for position, (i, _) in enumerate(pairs):
+        length = bisect.bisect_left(tails, i)
+
+        previous_positions.append(tail_positions[length - 1] if length else -1)
+
+        if length == len(tails):
+            tails.append(i)
+            tail_positions.append(position)
+        else:
+            tails[length] = i
+            tail_positions[length] = position
+
+    anchors = []
+
+    position = tail_positions[-1] if tail_positions else -1
+
+    while position != -1:
+        anchors.append(pairs[position])
+
+        position = previous_positions[position]
+
+    anchors.reverse()
+
+    return anchors
+
+
+def _get_matching_blocks(a: List[int], b: List[int]) -> List[_MatchingBlock]:
+    """Get blocks of matching lines, as (a index, b index, size)."""
+    matches: List[Tuple[int, int]] = []
+
+    budget = WORK_FACTOR * (len(a) + len(b))
+
+    regions = [(0, len(a), 0, len(b))]
+
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+
+            alo += 1
+            blo += 1
+
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+
+            matches.append((ahi, bhi))
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        size = (ahi - alo) + (bhi - blo)
+
+        if size > budget:
+            continue
+
+        budget -= size
+
+        anchors = _get_anchors(a, alo, ahi, b, blo, bhi)
+
+        if not anchors:
+            if (ahi - alo) * (bhi - blo) <= SMALL_REGION_SIZE:
+                import difflib  # Rarely needed, so don't slow down importing
+
+                for i, j, n in difflib.SequenceMatcher(
+                    None, a[alo:ahi], b[blo:bhi], autojunk=False
+                ).get_matching_blocks():
+                    matches.extend((alo + i + k, blo + j + k) for k in range(n))
+
+            continue
+
+        for i, j in anchors:
+            matches.append((i, j))
+
+            regions.append((alo, i, blo, j))
+
+            alo, blo = i + 1, j + 1
+
+        regions.append((alo, ahi, blo, bhi))
+
+    matches.sort()
+
+    blocks: List[_MatchingBlock] = []
+
+    for i, j in matches:
+        if (
+            blocks
+            and blocks[-1][0] + blocks[-1][2] == i
+            and blocks[-1][1] + blocks[-1][2] == j
+        ):
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + 1)
+        else:
+            blocks.append((i, j, 1))
+
+    return blocks
+
+
+def _get_changes(
+    blocks: List[_MatchingBlock], a_length: int, b_length: int
+) -> List[_Change]:
+    """Get changed regions between matching blocks, as (i1, i2, j1, j2)."""
+    changes = []
+
+    i = j = 0
+
+    for ai, bj, size in blocks + [(a_length, b_length, 0)]:
+        if i < ai or j < bj:
+            changes.append((i, ai, j, bj))
+
+        i, j = ai + size, bj + size
+
+    return changes
+
+
+def _split_lines(contents: str) -> List[str]:
+    """Split contents into lines, keeping line endings.
+
+    Like diff(1), only '\n' ends lines. So a '\r' before it is part of the
+    line, and the last line lacks '\n' when the contents don't end with one.
+    """
+    lines = [line + "\n" for line in contents.split("\n")]
+
+    lines[-1] = lines[-1][:-1]
+
+    if not lines[-1]:
+        del lines[-1]
+
+    return lines
+
+
+def _format_lines(prefix: str, lines: List[str]) -> List[str]:
+    """Get lines in unified diff format, like diff(1)."""
+    formatted_lines = []
+
+    for line in lines:
+        if line.endswith("\n"):
+            formatted_lines.append(prefix + line[:-1])
+        else:
+            formatted_lines.append(prefix + line)
+            formatted_lines.append(NO_NEWLINE_MARKER)
+
+    return formatted_lines
+
+
+def _format_range(start: int, end: int) -> str:
+    """Get range in unified diff format, like difflib."""
+    length = end - start
+
+    if length == 1:
+        return str(start + 1)
+
+    if not length:
+        return f"{start},0"
+
+    return f"{start + 1},{length}"
+
+
+def get_differences(
+    a: str,
+    b: str,
+    *,
+    fromfile: str,
+    tofile: str,
+    context_lines: int = CONTEXT_LINES,
+    max_input_size: int = MAX_INPUT_SIZE,
+    max_output_lines: int = MAX_OUTPUT_LINES,
+) -> List[str]:
+    """Get differences between contents in unified diff format.
+
+    Lines are matched using a patience diff, so that the cost grows about
+    linearly with the size of the contents, unlike difflib.
+
+    Like diff(1), changes to line endings are shown as changed lines, and a
+    missing newline at the end of the contents is marked.
+
+    If the contents together are larger than 'max_input_size' characters, or
+    the differences are longer than 'max_output_lines' lines, a summary is
+    returned instead of (the rest of) the differences.
+    """
+    if a == b:
+        return []
+
+    if len(a) + len(b) > max_input_size:
+        return [
+            f"Differences between {fromfile} and {tofile} not shown, as their size exceeds {max_input_size} characters."
+        ]
+
+    a_lines = _split_lines(a)
+    b_lines = _split_lines(b)
+
+    line_ids: Dict[str, int] = {}
+
+    a_ids = [line_ids.setdefault(line, len(line_ids)) for line in a_lines]
+    b_ids = [line_ids.setdefault(line, len(line_ids)) for line in b_lines]
+
+    changes = _get_changes(
+        _get_matching_blocks(a_ids, b_ids), len(a_lines), len(b_lines)
+    )
+
+    # Group changes into hunks. Changes are in the same hunk when the unchanged
+    # lines between them are shown as context anyway.
+
+    hunks: List[List[_Change]] = []
+
+    for change in changes:
+        if hunks and change[0] - hunks[-1][-1][1] <= 2 * context_lines:
+            hunks[-1].append(change)
+        else:
+            hunks.append([change])
+
+    lines = [f"--- {fromfile}", f"+++ {tofile}"]
+
+    for hunk in hunks:
+        a_start = max(0, hunk[0][0] - context_lines)
+        b_start = hunk[0][2] - (hunk[0][0] - a_start)
+        a_end = min(len(a_lines), hunk[-1][1] + context_lines)
+        b_end = hunk[-1][3] + (a_end - hunk[-1][1])
+
+        lines.append(
+            f"@@ -{_format_range(a_start, a_end)} +{_format_range(b_start, b_end)} @@"
+        )
+
+        position = a_start
+
+        for i1, i2, j1, j2 in hunk:
+            lines.extend(_format_lines(" ", a_lines[position:i1]))
+            lines.extend(_format_lines("-", a_lines[i1:i2]))
+            lines.extend(_format_lines("+", b_lines[j1:j2]))
+
+            position = i2
+
+        lines.extend(_format_lines(" ", a_lines[position:a_end]))
+
+        if len(lines) > max_output_lines:
+            del lines[max_output_lines:]
+
+            lines.append(
+                f"Further differences not shown, as they exceed {max_output_lines} lines."
+            )
+
+            break
+
+    return lines
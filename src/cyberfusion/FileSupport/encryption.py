@@ -1,8 +1,18 @@
 """Utilities for file encryption."""
 
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import struct
 import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
+from typing import Dict, List, Optional, Tuple
 
 from cyberfusion.FileSupport.exceptions import EncryptionError, DecryptionError
 
@@ -16,6 +26,13 @@ class MessageDigestEnum(str, Enum):
     SHA1 = "sha1"
 
 
+class FileFormatEnum(str, Enum):
+    """Formats of encrypted files."""
+
+    OPENSSL_ENC = "openssl-enc"  # Single stream, as written by `openssl enc`
+    CHUNKED = "chunked"  # Independently authenticated segments, see below
+
+
 @dataclass
 class EncryptionProperties:
     """Properties to encrypt files, needed by OpenSSL."""
@@ -23,43 +40,635 @@ class EncryptionProperties:
     cipher_name: str  # Get options with `openssl list -cipher-algorithms`
     message_digest: MessageDigestEnum
     password_file_path: str  # Create password with `openssl rand -hex 128`
+    # 'cipher_name' and 'message_digest' are not used for the chunked format
+    file_format: FileFormatEnum = FileFormatEnum.OPENSSL_ENC
+
+
+_Keys = Tuple[bytes, bytes]
+_Identity = Tuple[int, int, int, int]
+
+
+def _zeroise(data: bytearray) -> None:
+    """Overwrite data with zeros."""
+    data[:] = bytes(len(data))
+
+
+class KeyCache:
+    """Represents cache of key material, per password file.
+
+    Without this, every encryption and decryption reads the password file, and
+    for the chunked format, derives a master key (which is slow by design).
+
+    Key material of a password file is evicted when the file changes, i.e. when
+    its device, inode, size or modification time differ. Changes that keep all
+    of these the same (such as writing a password of the same length within the
+    file system's timestamp granularity) are not noticed: call 'evict' after
+    changing a password file in place.
+
+    Evicted key material is overwritten with zeros. This is best effort, as
+    Python may have copied it elsewhere.
+    """
+
+    def __init__(self, *, max_entries: int = 1024) -> None:
+        """Set attributes."""
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._identities: Dict[str, _Identity] = {}
+        self._passwords: Dict[str, bytearray] = {}
+        self._master_keys: OrderedDict[
+            Tuple[str, _Identity, str, str, int], bytearray
+        ] = OrderedDict()
+
+    def _evict(self, path: str) -> None:
+        """Evict key material of password file. Lock must be held."""
+        self._identities.pop(path, None)
+
+        password = self._passwords.pop(path, None)
+
+        if password is not None:
+            _zeroise(password)
+
+        for key in [key for key in self._master_keys if key[0] == path]:
+            _zeroise(self._master_keys.pop(key))
+
+    def _get_identity(self, path: str) -> _Identity:
+        """Get identity of password file, evicting if changed. Lock must be held."""
+        stat = os.stat(path)
+
+        identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        if self._identities.get(path) != identity:
+            self._evict(path)
+
+            self._identities[path] = identity
+
+        return identity
+
+    def _get_password(self, path: str) -> Tuple[_Identity, bytes]:
+        """Get identity of password file and password. Lock must be held.
+
+        The file is read after its identity is determined, so that the password
+        is never older than the identity it is cached with.
+        """
+        identity = self._get_identity(path)
+
+        if path not in self._passwords:
+            with open(path, "rb") as f:
+                password = f.readline()
+
+            # Like OpenSSL, only strip the newline. E.g. a carriage return
+            # before it is part of the password.
+
+            if password.endswith(b"\n"):
+                password = password[:-1]
+
+            self._passwords[path] = bytearray(password)
+
+        return identity, bytes(self._passwords[path])
+
+    def get_password(self, path: str) -> bytes:
+        """Get password from first line of file, like OpenSSL does."""
+        with self._lock:
+            return self._get_password(path)[1]
+
+    def get_master_key(self, path: str, iterations: int) -> bytes:
+        """Get master key for the chunked format.
+
+        The master key is derived from the password only (see '_derive_keys'),
+        so that it is derived once per password file, rather than once per file.
+        """
+        with self._lock:
+            identity, password = self._get_password(path)
+
+            key = (path, identity, _CHUNKED_DIGEST, _CHUNKED_CIPHER, iterations)
+
+            if key in self._master_keys:
+                self._master_keys.move_to_end(key)
+
+                return bytes(self._master_keys[key])
+
+        # Derive without holding lock, so that other threads aren't blocked
+
+        master_key = bytearray(
+            hashlib.pbkdf2_hmac(_CHUNKED_DIGEST, password, _MASTER_KEY_SALT, iterations)
+        )
+
+        with self._lock:
+            # Don't cache if the password file changed meanwhile, as the key
+            # would never be used.
+
+            if self._identities.get(path) == identity:
+                self._master_keys[key] = master_key
+
+            while len(self._master_keys) > self.max_entries:
+                _zeroise(self._master_keys.popitem(last=False)[1])
+
+        return bytes(master_key)
+
+    def evict(self, path: str) -> None:
+        """Evict key material of password file."""
+        with self._lock:
+            self._evict(path)
 
+    def clear(self) -> None:
+        """Evict key material of all password files."""
+        with self._lock:
+            for path in list(self._identities):
+                self._evict(path)
+
+
+KEY_CACHE = KeyCache()
+
+
+def _get_pipe(data: bytes) -> int:
+    """Get file descriptor to read data from.
+
+    Used to pass secrets to OpenSSL, so that they aren't visible in the process
+    list.
+    """
+    read_fd, write_fd = os.pipe()
+
+    with os.fdopen(write_fd, "wb") as f:
+        f.write(data + b"\n")
+
+    return read_fd
+
+
+def _get_encrypt_command(encryption_properties: EncryptionProperties) -> List[str]:
+    """Get OpenSSL command to encrypt stdin, without password."""
+    return [
+        "openssl",
+        "enc",
+        "-" + encryption_properties.cipher_name,
+        "-md",
+        encryption_properties.message_digest,
+    ]
+
+
+def _get_decrypt_command(
+    encryption_properties: EncryptionProperties, path: str
+) -> List[str]:
+    """Get OpenSSL command to decrypt file, without password."""
+    return [
+        "openssl",
+        "enc",
+        "-d",
+        "-" + encryption_properties.cipher_name,
+        "-md",
+        encryption_properties.message_digest,
+        "-in",
+        path,
+    ]
+
+
+def _check_output(
+    encryption_properties: EncryptionProperties, command: List[str], input_: bytes
+) -> bytes:
+    """Run OpenSSL command with password from key cache."""
+    password_fd = _get_pipe(
+        KEY_CACHE.get_password(encryption_properties.password_file_path)
+    )
+
+    try:
+        return subprocess.check_output(
+            command + ["-pass", f"fd:{password_fd}"],
+            input=input_,
+            pass_fds=(password_fd,),
+        )
+    finally:
+        os.close(password_fd)
+
+
+# Chunked format
+#
+# The header consists of a magic string (8 bytes), the segment size (4 bytes),
+# the amount of PBKDF2 iterations (4 bytes) and a random salt (16 bytes).
+#
+# From the password, a master key is derived with PBKDF2. Its salt is the same
+# for all files, so that this slow derivation is done once per password file
+# (see KeyCache), even for files created by other processes. From the master
+# key and the salt in the header, an encryption key and an authentication key
+# are derived with HMAC, which is cheap. As the salt differs per file, so do the
+# keys, so segments can't be moved between files.
+#
+# The header is followed by one or more segments. A segment consists of a
+# random nonce (16 bytes), ciphertext (at most segment size) and a tag (32
+# bytes). Plaintext is encrypted with AES-256-CTR by OpenSSL, using a secret
+# derived from the encryption key and the nonce. The tag is an HMAC-SHA256 over
+# the header, the index of the segment, whether it is the last segment, the
+# nonce and the ciphertext, so that segments can't be changed, reordered or
+# removed.
+#
+# As segments are independent, they are encrypted and decrypted concurrently,
+# comparing stops at the first differing segment, and segments that did not
+# change can be reused from the previous file (so that only changed segments
+# have to be written, see DeltaCopyItem).
+
+CHUNKED_MAGIC = b"CFFSENC1"
+CHUNKED_SEGMENT_SIZE = 256 * 1024
+CHUNKED_ITERATIONS = 600_000
+CHUNKED_WORKERS = os.cpu_count() or 1
+
+_CHUNKED_HEADER = struct.Struct(">8sII16s")
+_CHUNKED_DIGEST = "sha256"
+_CHUNKED_CIPHER = "aes-256-ctr"
+_SALT_SIZE = 16
+_NONCE_SIZE = 16
+_TAG_SIZE = 32
+
+
+_MASTER_KEY_SALT = b"cyberfusion.FileSupport chunked master key"
+
+
+def _derive_keys(
+    encryption_properties: EncryptionProperties, salt: bytes, iterations: int
+) -> _Keys:
+    """Get encryption key and authentication key of file.
+
+    Derived from the master key like HKDF-Expand does, with the salt of the
+    file as info.
+    """
+    master_key = KEY_CACHE.get_master_key(
+        encryption_properties.password_file_path, iterations
+    )
+
+    encryption_key = hmac.new(master_key, salt + b"\x01", hashlib.sha256).digest()
+    authentication_key = hmac.new(
+        master_key, encryption_key + salt + b"\x02", hashlib.sha256
+    ).digest()
+
+    return encryption_key, authentication_key
+
+
+def _run_ctr(
+    encryption_key: bytes, nonce: bytes, data: bytes, *, decrypt: bool
+) -> bytes:
+    """Encrypt or decrypt data with AES-256-CTR.
+
+    The secret is passed through a pipe, so that it isn't visible in the
+    process list.
+    """
+    read_fd = _get_pipe(
+        hmac.new(encryption_key, nonce, hashlib.sha256).hexdigest().encode()
+    )
 
-def encrypt_file(encryption_properties: EncryptionProperties, contents: str) -> bytes:
-    """Get contents for file to encrypt."""
     try:
         return subprocess.check_output(
             [
                 "openssl",
                 "enc",
-                "-" + encryption_properties.cipher_name,
+                *(["-d"] if decrypt else []),
+                "-" + _CHUNKED_CIPHER,
+                "-pbkdf2",
+                "-iter",
+                "1",
                 "-md",
-                encryption_properties.message_digest,
+                _CHUNKED_DIGEST,
+                "-nosalt",
                 "-pass",
-                "file:" + encryption_properties.password_file_path,
+                f"fd:{read_fd}",
             ],
-            input=contents.encode(),
+            input=data,
+            pass_fds=(read_fd,),
         )
-    except subprocess.CalledProcessError as e:
+    finally:
+        os.close(read_fd)
+
+
+def _get_tag(
+    authentication_key: bytes,
+    header: bytes,
+    index: int,
+    last: bool,
+    nonce: bytes,
+    ciphertext: bytes,
+) -> bytes:
+    """Get tag of segment."""
+    return hmac.new(
+        authentication_key,
+        header + struct.pack(">Q?", index, last) + nonce + ciphertext,
+        hashlib.sha256,
+    ).digest()
+
+
+def _encrypt_segment(
+    keys: _Keys, header: bytes, index: int, last: bool, plaintext: bytes
+) -> bytes:
+    """Get segment for plaintext."""
+    nonce = secrets.token_bytes(_NONCE_SIZE)
+
+    ciphertext = _run_ctr(keys[0], nonce, plaintext, decrypt=False)
+
+    return (
+        nonce + ciphertext + _get_tag(keys[1], header, index, last, nonce, ciphertext)
+    )
+
+
+def _decrypt_segment(
+    keys: _Keys, header: bytes, index: int, last: bool, segment: bytes
+) -> bytes:
+    """Get plaintext of segment."""
+    nonce = segment[:_NONCE_SIZE]
+    ciphertext = segment[_NONCE_SIZE:-_TAG_SIZE]
+    tag = segment[-_TAG_SIZE:]
+
+    if not hmac.compare_digest(
+        tag, _get_tag(keys[1], header, index, last, nonce, ciphertext)
+    ):
+        raise DecryptionError(f"Authenticating segment {index} failed.")
+
+    return _run_ctr(keys[0], nonce, ciphertext, decrypt=True)
+
+
+def _split_plaintext(plaintext: bytes, segment_size: int) -> List[bytes]:
+    """Get plaintext per segment. Empty plaintext has one empty segment."""
+    return [
+        plaintext[offset : offset + segment_size]
+        for offset in range(0, len(plaintext), segment_size)
+    ] or [b""]
+
+
+def _parse_chunked_file(path: str) -> Tuple[bytes, int, int, bytes, List[bytes]]:
+    """Get header, segment size, iterations, salt and segments of file."""
+    with open(path, "rb") as f:
+        contents = f.read()
+
+    header = contents[: _CHUNKED_HEADER.size]
+
+    if len(header) < _CHUNKED_HEADER.size:
+        raise DecryptionError("File is too small to be in chunked format.")
+
+    magic, segment_size, iterations, salt = _CHUNKED_HEADER.unpack(header)
+
+    if magic != CHUNKED_MAGIC:
+        raise DecryptionError("File is not in chunked format.")
+
+    segment_length = _NONCE_SIZE + segment_size + _TAG_SIZE
+
+    segments = [
+        contents[offset : offset + segment_length]
+        for offset in range(_CHUNKED_HEADER.size, len(contents), segment_length)
+    ]
+
+    if not segments or len(segments[-1]) < _NONCE_SIZE + _TAG_SIZE:
+        raise DecryptionError("File is truncated.")
+
+    return header, segment_size, iterations, salt, segments
+
+
+def _get_reusable_segments(
+    encryption_properties: EncryptionProperties, path: Optional[str]
+) -> Optional[Tuple[bytes, _Keys, List[bytes]]]:
+    """Get header, keys and segments of previous file, if they can be reused."""
+    if path is None or not os.path.exists(path):
+        return None
+
+    try:
+        header, segment_size, iterations, salt, segments = _parse_chunked_file(path)
+    except DecryptionError:
+        return None
+
+    if segment_size != CHUNKED_SEGMENT_SIZE or iterations != CHUNKED_ITERATIONS:
+        return None
+
+    return (
+        header,
+        _derive_keys(encryption_properties, salt, iterations),
+        segments,
+    )
+
+
+def _encrypt_chunked(
+    encryption_properties: EncryptionProperties,
+    contents: str,
+    previous_path: Optional[str],
+) -> bytes:
+    """Get contents for file to encrypt in chunked format."""
+    plaintexts = _split_plaintext(contents.encode(), CHUNKED_SEGMENT_SIZE)
+
+    previous_segments: List[bytes] = []
+
+    reusable_segments = _get_reusable_segments(encryption_properties, previous_path)
+
+    if reusable_segments:
+        header, keys, previous_segments = reusable_segments
+    else:
+        salt = secrets.token_bytes(_SALT_SIZE)
+
+        header = _CHUNKED_HEADER.pack(
+            CHUNKED_MAGIC, CHUNKED_SEGMENT_SIZE, CHUNKED_ITERATIONS, salt
+        )
+        keys = _derive_keys(encryption_properties, salt, CHUNKED_ITERATIONS)
+
+    def _encrypt(index: int) -> bytes:
+        last = index == len(plaintexts) - 1
+
+        # Reuse previous segment if its plaintext is the same. Whether it is the
+        # last segment must be the same as well, as the tag covers that.
+
+        if index < len(previous_segments) and last == (
+            index == len(previous_segments) - 1
+        ):
+            try:
+                if (
+                    _decrypt_segment(
+                        keys, header, index, last, previous_segments[index]
+                    )
+                    == plaintexts[index]
+                ):
+                    return previous_segments[index]
+            except DecryptionError:  # E.g. encrypted with other password
+                pass
+
+        return _encrypt_segment(keys, header, index, last, plaintexts[index])
+
+    with ThreadPoolExecutor(max_workers=CHUNKED_WORKERS) as executor:
+        return header + b"".join(executor.map(_encrypt, range(len(plaintexts))))
+
+
+def _decrypt_chunked(encryption_properties: EncryptionProperties, path: str) -> str:
+    """Get contents of encrypted file in chunked format."""
+    header, _, iterations, salt, segments = _parse_chunked_file(path)
+
+    keys = _derive_keys(encryption_properties, salt, iterations)
+
+    def _decrypt(index: int) -> bytes:
+        return _decrypt_segment(
+            keys, header, index, index == len(segments) - 1, segments[index]
+        )
+
+    with ThreadPoolExecutor(max_workers=CHUNKED_WORKERS) as executor:
+        return b"".join(executor.map(_decrypt, range(len(segments)))).decode()
+
+
+def _compare_chunked(
+    encryption_properties: EncryptionProperties, path: str, contents: str
+) -> bool:
+    """Get if contents of encrypted file in chunked format are equal."""
+    header, segment_size, iterations, salt, segments = _parse_chunked_file(path)
+
+    plaintexts = _split_plaintext(contents.encode(), segment_size)
+
+    # Sizes differ, so contents do too. Don't bother deriving keys.
+
+    if [len(plaintext) for plaintext in plaintexts] != [
+        len(segment) - _NONCE_SIZE - _TAG_SIZE for segment in segments
+    ]:
+        return False
+
+    keys = _derive_keys(encryption_properties, salt, iterations)
+
+    def _decrypt(index: int) -> bytes:
+        return _decrypt_segment(
+            keys, header, index, index == len(segments) - 1, segments[index]
+        )
+
+    # Decrypt as many segments at once as there are workers, and stop at the
+    # first batch with a differing segment.
+
+    with ThreadPoolExecutor(max_workers=CHUNKED_WORKERS) as executor:
+        for start in range(0, len(segments), CHUNKED_WORKERS):
+            indexes = range(start, min(start + CHUNKED_WORKERS, len(segments)))
+
+            for index, plaintext in zip(indexes, executor.map(_decrypt, indexes)):
+                if plaintext != plaintexts[index]:
+                    return False
+
+    return True
+
+
+def encrypt_file(
+    encryption_properties: EncryptionProperties,
+    contents: str,
+    *,
+    previous_path: Optional[str] = None,
+) -> bytes:
+    """Get contents for file to encrypt.
+
+    For the chunked format, segments of the file at 'previous_path' are reused
+    when their contents did not change.
+    """
+    if encryption_properties.file_format == FileFormatEnum.CHUNKED:
+        try:
+            return _encrypt_chunked(encryption_properties, contents, previous_path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise EncryptionError from e
+
+    try:
+        return _check_output(
+            encryption_properties,
+            _get_encrypt_command(encryption_properties),
+            contents.encode(),
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
         raise EncryptionError from e
 
 
 def decrypt_file(encryption_properties: EncryptionProperties, path: str) -> str:
     """Get contents of encrypted file."""
+    if encryption_properties.file_format == FileFormatEnum.CHUNKED:
+        try:
+            return _decrypt_chunked(encryption_properties, path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise DecryptionError from e
+
     try:
-        return subprocess.check_output(
-            [
-                "openssl",
-                "enc",
-                "-d",
-                "-" + encryption_properties.cipher_name,
-                "-md",
-                encryption_properties.message_digest,
-                "-pass",
-                "file:" + encryption_properties.password_file_path,
-                "-in",
-                path,
-            ]
+        return _check_output(
+            encryption_properties,
+            _get_decrypt_command(encryption_properties, path),
+            b"",
+        ).decode()
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise DecryptionError from e
+
+
+def compare_file(
+    encryption_properties: EncryptionProperties, path: str, contents: str
+) -> bool:
+    """Get if contents of encrypted file are equal to contents.
+
+    For the chunked format, only as many segments are decrypted as needed to
+    find a difference. When the size differs, nothing is decrypted.
+    """
+    if encryption_properties.file_format == FileFormatEnum.CHUNKED:
+        try:
+            return _compare_chunked(encryption_properties, path, contents)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise DecryptionError from e
+
+    return decrypt_file(encryption_properties, path) == contents
+
+
+async def _run_command(
+    encryption_properties: EncryptionProperties, command: List[str], input_: bytes
+) -> bytes:
+    """Run OpenSSL command with password from key cache, without blocking the event loop."""
+    password_fd = _get_pipe(
+        await asyncio.to_thread(
+            KEY_CACHE.get_password, encryption_properties.password_file_path
+        )
+    )
+
+    command = command + ["-pass", f"fd:{password_fd}"]
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            pass_fds=(password_fd,),
+        )
+
+        output, _ = await process.communicate(input_)
+    finally:
+        os.close(password_fd)
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+
+    return output
+
+
+async def async_encrypt_file(
+    encryption_properties: EncryptionProperties,
+    contents: str,
+    *,
+    previous_path: Optional[str] = None,
+) -> bytes:
+    """Get contents for file to encrypt, without blocking the event loop."""
+    if encryption_properties.file_format == FileFormatEnum.CHUNKED:
+        return await asyncio.to_thread(
+            encrypt_file,
+            encryption_properties,
+            contents,
+            previous_path=previous_path,
+        )
+
+    try:
+        return await _run_command(
+            encryption_properties,
+            _get_encrypt_command(encryption_properties),
+            contents.encode(),
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise EncryptionError from e
+
+
+async def async_decrypt_file(
+    encryption_properties: EncryptionProperties, path: str
+) -> str:
+    """Get contents of encrypted file, without blocking the event loop."""
+    if encryption_properties.file_format == FileFormatEnum.CHUNKED:
+        return await asyncio.to_thread(decrypt_file, encryption_properties, path)
+
+    try:
+        return (
+            await _run_command(
+                encryption_properties,
+                _get_decrypt_command(encryption_properties, path),
+                b"",
+            )
         ).decode()
-    except subprocess.CalledProcessError as e:
+    except (OSError, subprocess.CalledProcessError) as e:
         raise DecryptionError from e
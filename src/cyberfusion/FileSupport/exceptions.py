@@ -11,3 +11,9 @@ class DecryptionError(Exception):
     """Decrypting failed."""
 
     pass
+
+
+class NotMaterializedError(Exception):
+    """Replacement was used before its contents were written to the tmp file."""
+
+    pass
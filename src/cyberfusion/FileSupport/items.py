@@ -0,0 +1,214 @@
+"""Items."""
+
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from cyberfusion.QueueSupport.exceptions import CommandQueueFulfillFailed
+from cyberfusion.QueueSupport.items import _Item
+from cyberfusion.QueueSupport.items.copy import CopyItem
+from cyberfusion.QueueSupport.outcomes import CopyItemCopyOutcome
+
+from cyberfusion.FileSupport.outcomes import CommandItemTimedRunOutcome
+
+BLOCK_SIZE = 4096
+COMMAND_CONCURRENCY = 8
+
+
+class DeltaCopyItem(CopyItem):
+    """Represents item.
+
+    Like CopyItem, but only writes blocks of the destination file that differ
+    from the source file, instead of rewriting the entire destination file.
+    """
+
+    def __init__(
+        self,
+        *,
+        source: str,
+        destination: str,
+        reference: Optional[str] = None,
+        hide_outcomes: bool = False,
+        fail_silently: bool = False,
+        fulfill_in_preview: bool = False,
+        block_size: int = BLOCK_SIZE,
+    ) -> None:
+        """Set attributes."""
+        super().__init__(
+            source=source,
+            destination=destination,
+            reference=reference,
+            hide_outcomes=hide_outcomes,
+            fail_silently=fail_silently,
+            fulfill_in_preview=fulfill_in_preview,
+        )
+
+        self.block_size = block_size
+
+    def _write_changed_blocks(self) -> int:
+        """Write blocks of source file that differ from destination file.
+
+        Blocks are compared at the same offsets, so content that stays in place
+        (such as the beginning of a file that is appended to, or lines that are
+        changed without changing their length) is not written. The destination
+        file is truncated to the size of the source file afterwards.
+
+        Returns amount of written blocks.
+        """
+        written_blocks = 0
+        offset = 0
+
+        with (
+            open(self.source, "rb") as source_file,
+            open(self.destination, "r+b") as destination_file,
+        ):
+            source_fd = source_file.fileno()
+            destination_fd = destination_file.fileno()
+
+            while True:
+                source_block = os.pread(source_fd, self.block_size, offset)
+
+                if not source_block:
+                    break
+
+                destination_block = os.pread(destination_fd, len(source_block), offset)
+
+                if source_block != destination_block:
+                    os.pwrite(destination_fd, source_block, offset)
+
+                    written_blocks += 1
+
+                offset += len(source_block)
+
+            os.ftruncate(destination_fd, offset)
+
+        return written_blocks
+
+    def fulfill(self) -> List[CopyItemCopyOutcome]:
+        """Fulfill outcomes."""
+        outcomes = self.outcomes
+
+        for outcome in outcomes:
+            if not os.path.isfile(outcome.destination):
+                shutil.copyfile(outcome.source, outcome.destination)
+            else:
+                self._write_changed_blocks()
+
+        return outcomes
+
+
+class ConcurrentCommandsItem(_Item):
+    """Represents item.
+
+    Runs commands concurrently, at most 'concurrency' at once. Commands are
+    specified as (key, command). Commands with the same key are run one after
+    another, in the specified order; commands without key are independent.
+
+    When a command fails, later commands with the same key are not run. Other
+    commands are run to completion, after which the first failure is raised.
+    """
+
+    def __init__(
+        self,
+        *,
+        commands: List[Tuple[Optional[str], List[str]]],
+        concurrency: int = COMMAND_CONCURRENCY,
+        reference: Optional[str] = None,
+        hide_outcomes: bool = False,
+        fail_silently: bool = False,
+        fulfill_in_preview: bool = False,
+    ) -> None:
+        """Set attributes."""
+        self.commands = commands
+        self.concurrency = concurrency
+        self._reference = reference
+        self._hide_outcomes = hide_outcomes
+        self._fail_silently = fail_silently
+        self._fulfill_in_preview = fulfill_in_preview
+
+    @property
+    def outcomes(self) -> List[CommandItemTimedRunOutcome]:
+        """Get outcomes of item."""
+        outcomes = []
+
+        for key, command in self.commands:
+            outcomes.append(CommandItemTimedRunOutcome(command=command, key=key))
+
+        return outcomes
+
+    def _run(self, outcome: CommandItemTimedRunOutcome) -> None:
+        """Run command of outcome."""
+        started_at = time.monotonic()
+
+        try:
+            output = subprocess.run(
+                outcome.command,
+                check=True,
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+
+            outcome.stdout = output.stdout
+            outcome.stderr = output.stderr
+        except subprocess.CalledProcessError as e:
+            raise CommandQueueFulfillFailed(
+                self, command=outcome.command, stdout=e.stdout, stderr=e.stderr
+            ) from e
+        finally:
+            outcome.duration = time.monotonic() - started_at
+
+    def _run_chain(self, chain: List[CommandItemTimedRunOutcome]) -> None:
+        """Run commands of outcomes one after another."""
+        for outcome in chain:
+            self._run(outcome)
+
+    def fulfill(self) -> List[CommandItemTimedRunOutcome]:
+        """Fulfill outcomes."""
+        outcomes = self.outcomes
+
+        # Group outcomes into chains that are run one after another, one chain
+        # per key. Chains themselves are run concurrently.
+
+        chains: List[List[CommandItemTimedRunOutcome]] = []
+        chains_by_key: Dict[str, List[CommandItemTimedRunOutcome]] = {}
+
+        for outcome in outcomes:
+            if outcome.key is None:
+                chains.append([outcome])
+
+                continue
+
+            if outcome.key not in chains_by_key:
+                chains_by_key[outcome.key] = []
+
+                chains.append(chains_by_key[outcome.key])
+
+            chains_by_key[outcome.key].append(outcome)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._run_chain, chain) for chain in chains]
+
+        for future in futures:
+            future.result()  # Raise exception, if any
+
+        return outcomes
+
+    def __eq__(self, other: object) -> bool:
+        """Get equality based on attributes."""
+        if not isinstance(other, ConcurrentCommandsItem):
+            return False
+
+        return other.commands == self.commands
+
+    def __hash__(self) -> int:
+        """Get hash based on the same attributes as equality."""
+        return hash(
+            (
+                ConcurrentCommandsItem,
+                tuple((key, tuple(command)) for key, command in self.commands),
+            )
+        )
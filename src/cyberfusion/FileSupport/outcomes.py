@@ -0,0 +1,36 @@
+"""Outcomes."""
+
+from typing import List, Optional
+
+from cyberfusion.QueueSupport.outcomes import CommandItemRunOutcome
+from cyberfusion.QueueSupport.sentinels import UNKNOWN
+
+
+class CommandItemTimedRunOutcome(CommandItemRunOutcome):
+    """Represents outcome.
+
+    Like CommandItemRunOutcome, but with the key that the command is
+    serialised by, and how long running it took (in seconds).
+    """
+
+    def __init__(
+        self,
+        *,
+        command: List[str],
+        key: Optional[str] = None,
+        stdout: str | UNKNOWN = UNKNOWN,
+        stderr: str | UNKNOWN = UNKNOWN,
+        duration: Optional[float] = None,
+    ) -> None:
+        """Set attributes."""
+        super().__init__(command=command, stdout=stdout, stderr=stderr)
+
+        self.key = key
+        self.duration = duration
+
+    def __str__(self) -> str:
+        """Get human-readable string."""
+        if self.duration is None:
+            return super().__str__()
+
+        return f"{super().__str__()} (took {self.duration:.2f}s)"
@@ -0,0 +1,89 @@
+"""Classes for scheduling commands."""
+
+import threading
+import warnings
+from typing import Callable, List, Optional, Tuple
+
+from cyberfusion.QueueSupport import Queue
+
+from cyberfusion.FileSupport.items import COMMAND_CONCURRENCY, ConcurrentCommandsItem
+from cyberfusion.FileSupport.utilities import add_items_to_queue
+
+
+def _get_reference(command: List[str], reference: Optional[str]) -> Optional[str]:
+    """Get key to serialise command by: its reference."""
+    return reference
+
+
+class CommandScheduler:
+    """Collects commands of replacements, to run them concurrently.
+
+    Pass to DestinationFileReplacement as 'command_scheduler'. Instead of adding
+    a CommandItem to the queue per replacement, commands are collected. Call
+    'add_to_queue' after adding replacements to the queue: commands are then
+    run concurrently once all files before them are copied.
+
+    Commands with the same key are run one after another. The key is determined
+    by 'key', called with the command and the replacement's reference. By
+    default, the reference is the key.
+
+    Compared to a CommandItem per replacement, this changes ordering and
+    failure behaviour:
+
+    - Commands run after all items added to the queue before 'add_to_queue' is
+      called, instead of right after the copy of their own file. So if an
+      earlier item fails, no commands are run, even for files that were
+      already copied (e.g. services are not reloaded).
+    - If 'add_to_queue' is not called, commands are not run at all. A warning
+      is emitted when a scheduler that still holds commands is garbage
+      collected.
+    """
+
+    def __init__(
+        self,
+        queue: Queue,
+        *,
+        concurrency: int = COMMAND_CONCURRENCY,
+        key: Callable[[List[str], Optional[str]], Optional[str]] = _get_reference,
+    ) -> None:
+        """Set attributes."""
+        self.queue = queue
+        self.concurrency = concurrency
+        self.key = key
+
+        self._commands: List[Tuple[Optional[str], List[str]]] = []
+        self._lock = threading.Lock()  # Replacements may be added from threads
+
+    def add(self, command: List[str], *, reference: Optional[str] = None) -> None:
+        """Add command.
+
+        Like the queue does for CommandItems, equal commands are run once.
+        """
+        with self._lock:
+            if any(
+                command == existing_command for _, existing_command in self._commands
+            ):
+                return
+
+            self._commands.append((self.key(command, reference), command))
+
+    def add_to_queue(self) -> None:
+        """Add item for added commands to queue, and start collecting anew."""
+        with self._lock:
+            commands, self._commands = self._commands, []
+
+        if not commands:
+            return
+
+        add_items_to_queue(
+            self.queue,
+            [ConcurrentCommandsItem(commands=commands, concurrency=self.concurrency)],
+        )
+
+    def __del__(self) -> None:
+        """Warn if added commands were not added to queue."""
+        if self._commands:
+            warnings.warn(
+                f"Command scheduler was garbage collected with {len(self._commands)} command(s) not added to the queue. Call 'add_to_queue' to run them.",
+                RuntimeWarning,
+            )
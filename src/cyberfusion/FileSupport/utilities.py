@@ -0,0 +1,68 @@
+"""Generic utilities."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from typing import TYPE_CHECKING, Awaitable, Iterable, List, TypeVar
+
+if TYPE_CHECKING:
+    from cyberfusion.QueueSupport import Queue
+    from cyberfusion.QueueSupport.items import _Item
+
+CONCURRENCY = 32
+
+T = TypeVar("T")
+
+# Locks are per queue rather than global, so that threads adding to different
+# queues don't wait for each other. Queues are weakly referenced, so that their
+# locks don't keep them alive.
+
+_queue_locks: weakref.WeakKeyDictionary[Queue, threading.Lock] = (
+    weakref.WeakKeyDictionary()
+)
+_queue_locks_lock = threading.Lock()
+
+
+async def gather_with_concurrency(
+    awaitables: Iterable[Awaitable[T]], *, concurrency: int = CONCURRENCY
+) -> List[T]:
+    """Await awaitables concurrently, but at most 'concurrency' at once.
+
+    Results are returned in the order of the awaitables, like asyncio.gather.
+    Use this to limit the amount of open files and OpenSSL processes when
+    awaiting many replacements, e.g. 'DestinationFileReplacement.async_create'.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _await(awaitable: Awaitable[T]) -> T:
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(_await(awaitable) for awaitable in awaitables))
+
+
+def get_queue_lock(queue: Queue) -> threading.Lock:
+    """Get lock to hold while adding items to queue from threads.
+
+    The queue is not thread-safe. Every caller gets the same lock for the same
+    queue.
+    """
+    with _queue_locks_lock:
+        if queue not in _queue_locks:
+            _queue_locks[queue] = threading.Lock()
+
+        return _queue_locks[queue]
+
+
+def add_items_to_queue(queue: Queue, items: Iterable[_Item]) -> None:
+    """Add items to queue atomically.
+
+    Items added to the same queue by other threads meanwhile are added before
+    or after all items, never in between. Only adding holds the lock, so
+    determine items (e.g. by reading files) before calling this.
+    """
+    with get_queue_lock(queue):
+        for item in items:
+            queue.add(item)
@@ -6,11 +6,12 @@ from pathlib import Path
 from typing import Generator
 
 import pytest
+from pytest_mock import MockerFixture
 
 from cyberfusion.QueueSupport import Queue
 
 from cyberfusion.FileSupport import EncryptionProperties
-from cyberfusion.FileSupport.encryption import MessageDigestEnum
+from cyberfusion.FileSupport.encryption import FileFormatEnum, MessageDigestEnum
 
 
 def get_path() -> str:
@@ -75,3 +76,21 @@ def encryption_properties(
         message_digest=MessageDigestEnum.SHA1,
         password_file_path=encryption_password_file_path,
     )
+
+
+@pytest.fixture
+def chunked_encryption_properties(
+    mocker: MockerFixture, encryption_password_file_path: str
+) -> EncryptionProperties:
+    # Small segments so that contents span multiple segments, and few iterations
+    # to keep tests fast.
+
+    mocker.patch("cyberfusion.FileSupport.encryption.CHUNKED_SEGMENT_SIZE", 4)
+    mocker.patch("cyberfusion.FileSupport.encryption.CHUNKED_ITERATIONS", 1000)
+
+    return EncryptionProperties(
+        cipher_name="aes-256-ctr",
+        message_digest=MessageDigestEnum.SHA1,
+        password_file_path=encryption_password_file_path,
+        file_format=FileFormatEnum.CHUNKED,
+    )
@@ -2,6 +2,8 @@ import os
 
 import pytest
 
+from cyberfusion.FileSupport.scheduler import CommandScheduler
+from cyberfusion.FileSupport.outcomes import CommandItemTimedRunOutcome
 from cyberfusion.FileSupport import (
     DestinationFileReplacement,
     EncryptionProperties,
@@ -56,6 +58,61 @@ def test_destination_file_replacement_exists(
     assert not os.path.exists(destination_file_replacement.tmp_path)
 
 
+def test_destination_file_replacement_delta(queue: Queue, existent_path: str) -> None:
+    CONTENTS = "foobar\n" * 4096
+
+    with open(existent_path, "w") as f:
+        f.write(CONTENTS + "foobaz\n")
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=existent_path, delta=True
+    )
+    destination_file_replacement.add_to_queue()
+
+    _, outcomes = queue.process(preview=False)
+
+    assert len(outcomes) == 1
+    assert open(existent_path, "r").read() == CONTENTS
+    assert not os.path.exists(destination_file_replacement.tmp_path)
+
+
+def test_destination_file_replacement_command_scheduler(
+    queue: Queue, non_existent_path: str
+) -> None:
+    command_scheduler = CommandScheduler(queue)
+
+    destination_file_replacements = [
+        DestinationFileReplacement(
+            queue,
+            contents="foobar\n",
+            destination_file_path=non_existent_path + str(i),
+            command=["cat", non_existent_path + str(i)],
+            reference=str(i),
+            command_scheduler=command_scheduler,
+        )
+        for i in range(2)
+    ]
+
+    for destination_file_replacement in destination_file_replacements:
+        destination_file_replacement.add_to_queue()
+
+    command_scheduler.add_to_queue()
+
+    _, outcomes = queue.process(preview=False)
+
+    command_outcomes = [
+        outcome
+        for outcome in outcomes
+        if isinstance(outcome, CommandItemTimedRunOutcome)
+    ]
+
+    assert [outcome.stdout for outcome in command_outcomes] == ["foobar\n"] * 2
+    assert all(outcome.duration is not None for outcome in command_outcomes)
+
+    for i in range(2):
+        os.unlink(non_existent_path + str(i))
+
+
 def test_destination_file_encrypted(
     queue: Queue, non_existent_path: str, encryption_properties: EncryptionProperties
 ) -> None:
@@ -72,3 +129,41 @@ def test_destination_file_encrypted(
         decrypt_file(encryption_properties, destination_file_replacement.tmp_path)
         == CONTENTS
     )
+
+
+def test_destination_file_chunked_encrypted_delta(
+    queue: Queue,
+    non_existent_path: str,
+    chunked_encryption_properties: EncryptionProperties,
+) -> None:
+    DestinationFileReplacement(
+        queue,
+        contents="foobar\nfoobaz\n",
+        destination_file_path=non_existent_path,
+        encryption_properties=chunked_encryption_properties,
+        delta=True,
+    ).add_to_queue()
+
+    queue.process(preview=False)
+
+    assert (
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+        == "foobar\nfoobaz\n"
+    )
+
+    queue = Queue()
+
+    DestinationFileReplacement(
+        queue,
+        contents="foobar\nfoobax\n",
+        destination_file_path=non_existent_path,
+        encryption_properties=chunked_encryption_properties,
+        delta=True,
+    ).add_to_queue()
+
+    queue.process(preview=False)
+
+    assert (
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+        == "foobar\nfoobax\n"
+    )
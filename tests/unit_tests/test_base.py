@@ -1,16 +1,25 @@
-from typing import Generator
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Generator
 from cyberfusion.Common import get_tmp_file
 import pytest
+from pytest_mock import MockerFixture
 from cyberfusion.QueueSupport.items.command import CommandItem
 from cyberfusion.QueueSupport.items.copy import CopyItem
 from cyberfusion.QueueSupport.items.unlink import UnlinkItem
 
+from cyberfusion.FileSupport.items import ConcurrentCommandsItem, DeltaCopyItem
+from cyberfusion.FileSupport.scheduler import CommandScheduler
+
 from cyberfusion.FileSupport import (
     DestinationFileReplacement,
     _DestinationFile,
     EncryptionProperties,
     encrypt_file,
+    decrypt_file,
     DecryptionError,
+    NotMaterializedError,
 )
 from cyberfusion.QueueSupport import Queue
 
@@ -43,6 +52,53 @@ def test_destination_file_encrypted_contents_failed(
         ).decrypt()
 
 
+def test_destination_file_async_decrypt_failed(
+    existent_path: str, encryption_properties: EncryptionProperties
+) -> None:
+    with pytest.raises(
+        DecryptionError,
+        match=f"Decrypting the destination file at '{existent_path}' failed. Note that the file must already be encrypted using the specified encryption properties.",
+    ):
+        asyncio.run(
+            _DestinationFile(
+                path=existent_path, encryption_properties=encryption_properties
+            ).async_decrypt()
+        )
+
+
+def test_destination_file_async_decrypt_not_exists(
+    non_existent_path: str, encryption_properties: EncryptionProperties
+) -> None:
+    assert (
+        asyncio.run(
+            _DestinationFile(
+                path=non_existent_path, encryption_properties=encryption_properties
+            ).async_decrypt()
+        )
+        is None
+    )
+
+
+def test_destination_file_compare_not_exists(
+    non_existent_path: str, chunked_encryption_properties: EncryptionProperties
+) -> None:
+    assert not _DestinationFile(
+        path=non_existent_path, encryption_properties=chunked_encryption_properties
+    ).compare(CONTENTS)
+
+
+def test_destination_file_compare_failed(
+    existent_path: str, chunked_encryption_properties: EncryptionProperties
+) -> None:
+    with pytest.raises(
+        DecryptionError,
+        match=f"Decrypting the destination file at '{existent_path}' failed. Note that the file must already be encrypted using the specified encryption properties.",
+    ):
+        _DestinationFile(
+            path=existent_path, encryption_properties=chunked_encryption_properties
+        ).compare(CONTENTS)
+
+
 # DestinationFileReplacement: contents
 
 
@@ -68,6 +124,85 @@ def test_destination_file_replacement_not_raises_no_contents_without_newline(
     ).contents
 
 
+# DestinationFileReplacement: retain_contents
+
+
+def test_destination_file_replacement_not_retain_contents(
+    queue: Queue, non_existent_path: str
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        retain_contents=False,
+    )
+
+    assert destination_file_replacement._contents is None
+    assert destination_file_replacement.contents == CONTENTS
+
+
+def test_destination_file_replacement_not_retain_contents_encrypted(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=encryption_properties,
+        retain_contents=False,
+    )
+
+    assert destination_file_replacement._contents is None
+    assert destination_file_replacement.contents == CONTENTS
+
+
+def test_destination_file_replacement_not_retain_contents_encrypted_not_changed(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(encryption_properties, CONTENTS))
+
+    assert not DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=encryption_properties,
+        retain_contents=False,
+    ).changed
+
+
+def test_destination_file_replacement_slots(
+    queue: Queue, non_existent_path: str
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=non_existent_path
+    )
+
+    assert not hasattr(destination_file_replacement, "__dict__")
+    assert not hasattr(destination_file_replacement.destination_file, "__dict__")
+
+
+def test_destination_file_replacement_set_encryption_properties(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=non_existent_path
+    )
+
+    destination_file_replacement.encryption_properties = encryption_properties
+
+    assert (
+        destination_file_replacement.destination_file.encryption_properties
+        == encryption_properties
+    )
+
+
 # DestinationFileReplacement: default_comment_character
 
 
@@ -116,6 +251,97 @@ def test_destination_file_write_to_file_contents(
     assert open(PATH, "r").read() == CONTENTS
 
 
+# DestinationFileReplacement: materialize
+
+
+def test_destination_file_replacement_not_materialize(
+    queue: Queue, non_existent_path: str
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        materialize=False,
+    )
+
+    assert open(destination_file_replacement.tmp_path, "r").read() == ""
+
+    destination_file_replacement.materialize()
+
+    assert open(destination_file_replacement.tmp_path, "r").read() == CONTENTS
+
+
+@pytest.mark.parametrize(
+    "use",
+    [
+        lambda replacement: replacement.changed,
+        lambda replacement: asyncio.run(replacement.async_changed()),
+        lambda replacement: replacement.differences,
+        lambda replacement: replacement.add_to_queue(),
+        lambda replacement: asyncio.run(replacement.async_add_to_queue()),
+    ],
+)
+def test_destination_file_replacement_not_materialized_raises(
+    queue: Queue,
+    existent_path: str,
+    use: Callable[[DestinationFileReplacement], Any],
+) -> None:
+    with open(existent_path, "w") as f:
+        f.write("foobaz\n")
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=existent_path,
+        materialize=False,
+    )
+
+    with pytest.raises(NotMaterializedError):
+        use(destination_file_replacement)
+
+    assert queue.item_mappings == []
+
+    asyncio.run(destination_file_replacement.async_materialize())
+
+    use(destination_file_replacement)
+
+
+def test_destination_file_replacement_async_create(
+    queue: Queue, non_existent_path: str
+) -> None:
+    destination_file_replacement = asyncio.run(
+        DestinationFileReplacement.async_create(
+            queue,
+            contents=CONTENTS,
+            destination_file_path=non_existent_path,
+            retain_contents=False,
+        )
+    )
+
+    assert destination_file_replacement._contents is None
+    assert open(destination_file_replacement.tmp_path, "r").read() == CONTENTS
+
+
+def test_destination_file_replacement_async_create_encrypted(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    destination_file_replacement = asyncio.run(
+        DestinationFileReplacement.async_create(
+            queue,
+            contents=CONTENTS,
+            destination_file_path=non_existent_path,
+            encryption_properties=encryption_properties,
+        )
+    )
+
+    assert (
+        decrypt_file(encryption_properties, destination_file_replacement.tmp_path)
+        == CONTENTS
+    )
+
+
 # DestinationFileReplacement: changed
 
 
@@ -151,6 +377,19 @@ def test_destination_file_replacement_changed_when_encrypted_changed(
     ).changed
 
 
+def test_destination_file_replacement_changed_when_encrypted_not_exists(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    assert DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=encryption_properties,
+    ).changed
+
+
 def test_destination_file_replacement_changed_when_changed(
     queue: Queue, non_existent_path: str
 ) -> None:
@@ -170,6 +409,195 @@ def test_destination_file_replacement_not_changed_when_not_changed(
     ).changed
 
 
+@pytest.mark.parametrize("changed", [True, False])
+def test_destination_file_replacement_changed_when_chunked(
+    queue: Queue,
+    non_existent_path: str,
+    chunked_encryption_properties: EncryptionProperties,
+    changed: bool,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    assert (
+        DestinationFileReplacement(
+            queue,
+            contents=CONTENTS + "-example" if changed else CONTENTS,
+            destination_file_path=non_existent_path,
+            encryption_properties=chunked_encryption_properties,
+        ).changed
+        is changed
+    )
+
+
+def test_destination_file_replacement_chunked_reuses_segments(
+    queue: Queue,
+    non_existent_path: str,
+    chunked_encryption_properties: EncryptionProperties,
+) -> None:
+    destination_contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+
+    with open(non_existent_path, "wb") as f:
+        f.write(destination_contents)
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=chunked_encryption_properties,
+    )
+
+    assert (
+        open(destination_file_replacement.tmp_path, "rb").read() == destination_contents
+    )
+
+
+# DestinationFileReplacement: async_changed
+
+
+@pytest.mark.parametrize("changed", [True, False])
+def test_destination_file_replacement_async_changed_when_chunked(
+    queue: Queue,
+    non_existent_path: str,
+    chunked_encryption_properties: EncryptionProperties,
+    changed: bool,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    assert (
+        asyncio.run(
+            DestinationFileReplacement(
+                queue,
+                contents=CONTENTS + "-example" if changed else CONTENTS,
+                destination_file_path=non_existent_path,
+                encryption_properties=chunked_encryption_properties,
+            ).async_changed()
+        )
+        is changed
+    )
+
+
+@pytest.mark.parametrize(
+    "use",
+    [
+        lambda replacement: replacement.async_changed(),
+        lambda replacement: replacement.async_add_to_queue(),
+        lambda replacement: replacement.async_materialize(),
+    ],
+)
+def test_destination_file_replacement_async_not_retain_contents_not_blocks(
+    mocker: MockerFixture,
+    queue: Queue,
+    non_existent_path: str,
+    chunked_encryption_properties: EncryptionProperties,
+    use: Callable[[DestinationFileReplacement], Awaitable[Any]],
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    thread_idents = []
+
+    def _decrypt_file(*args: Any, **kwargs: Any) -> str:
+        thread_idents.append(threading.get_ident())
+
+        return decrypt_file(*args, **kwargs)
+
+    mocker.patch(
+        "cyberfusion.FileSupport.encryption.decrypt_file", side_effect=_decrypt_file
+    )
+
+    async def _use() -> None:
+        destination_file_replacement = await DestinationFileReplacement.async_create(
+            queue,
+            contents=CONTENTS,
+            destination_file_path=non_existent_path,
+            encryption_properties=chunked_encryption_properties,
+            retain_contents=False,
+        )
+
+        await use(destination_file_replacement)
+
+    asyncio.run(_use())
+
+    assert thread_idents
+    assert threading.get_ident() not in thread_idents  # Event loop thread
+
+
+def test_destination_file_replacement_async_changed_when_encrypted_not_changed(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(encryption_properties, CONTENTS))
+
+    assert not asyncio.run(
+        DestinationFileReplacement(
+            queue,
+            contents=CONTENTS,
+            destination_file_path=non_existent_path,
+            encryption_properties=encryption_properties,
+        ).async_changed()
+    )
+
+
+def test_destination_file_replacement_async_changed_when_encrypted_changed(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(encryption_properties, CONTENTS + "-example"))
+
+    assert asyncio.run(
+        DestinationFileReplacement(
+            queue,
+            contents=CONTENTS,
+            destination_file_path=non_existent_path,
+            encryption_properties=encryption_properties,
+        ).async_changed()
+    )
+
+
+def test_destination_file_replacement_async_changed_when_encrypted_not_exists(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    assert asyncio.run(
+        DestinationFileReplacement(
+            queue,
+            contents=CONTENTS,
+            destination_file_path=non_existent_path,
+            encryption_properties=encryption_properties,
+        ).async_changed()
+    )
+
+
+def test_destination_file_replacement_async_changed_when_changed(
+    queue: Queue, non_existent_path: str
+) -> None:
+    assert asyncio.run(
+        DestinationFileReplacement(
+            queue, contents=CONTENTS, destination_file_path=non_existent_path
+        ).async_changed()
+    )
+
+
+def test_destination_file_replacement_async_changed_when_not_changed(
+    queue: Queue, existent_path: str
+) -> None:
+    with open(existent_path, "w") as f:
+        f.write(CONTENTS)
+
+    assert not asyncio.run(
+        DestinationFileReplacement(
+            queue, contents=CONTENTS, destination_file_path=existent_path
+        ).async_changed()
+    )
+
+
 # DestinationFileReplacement: add_to_queue
 
 
@@ -405,6 +833,246 @@ def test_destination_file_replacement_unlink_item_in_queue_when_changed(
     assert items[items.index(unlink_item)].hide_outcomes is True
 
 
+# DestinationFileReplacement: async_add_to_queue
+
+
+def test_destination_file_replacement_async_add_to_queue_when_encrypted_not_changed(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(encryption_properties, CONTENTS))
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=encryption_properties,
+        command=COMMAND,
+    )
+
+    asyncio.run(destination_file_replacement.async_add_to_queue())
+
+    assert [item_mapping.item for item_mapping in queue.item_mappings] == [
+        UnlinkItem(path=destination_file_replacement.tmp_path)
+    ]
+
+
+def test_destination_file_replacement_async_add_to_queue_when_changed(
+    queue: Queue, non_existent_path: str
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        command=COMMAND,
+    )
+
+    asyncio.run(destination_file_replacement.async_add_to_queue())
+
+    assert [item_mapping.item for item_mapping in queue.item_mappings] == [
+        CopyItem(
+            source=destination_file_replacement.tmp_path,
+            destination=non_existent_path,
+        ),
+        CommandItem(command=COMMAND),
+        UnlinkItem(path=destination_file_replacement.tmp_path),
+    ]
+
+
+# DestinationFileReplacement: differences
+
+
+def test_destination_file_replacement_differences_not_exists(
+    queue: Queue, non_existent_path: str
+) -> None:
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=non_existent_path
+    )
+
+    assert destination_file_replacement.differences == [
+        f"--- {non_existent_path}",
+        f"+++ {destination_file_replacement.tmp_path}",
+        "@@ -0,0 +1 @@",
+        "+foobar",
+    ]
+
+
+def test_destination_file_replacement_differences_exists(
+    queue: Queue, existent_path: str
+) -> None:
+    with open(existent_path, "w") as f:
+        f.write("foobaz\n")
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=existent_path
+    )
+
+    assert destination_file_replacement.differences == [
+        f"--- {existent_path}",
+        f"+++ {destination_file_replacement.tmp_path}",
+        "@@ -1 +1 @@",
+        "-foobaz",
+        "+foobar",
+    ]
+
+
+def test_destination_file_replacement_differences_not_changed(
+    queue: Queue, existent_path: str
+) -> None:
+    with open(existent_path, "w") as f:
+        f.write(CONTENTS)
+
+    assert (
+        DestinationFileReplacement(
+            queue, contents=CONTENTS, destination_file_path=existent_path
+        ).differences
+        == []
+    )
+
+
+def test_destination_file_replacement_differences_exists_too_large(
+    queue: Queue, existent_path: str
+) -> None:
+    with open(existent_path, "w") as f:
+        f.write("foobaz\n" * 2)
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=existent_path
+    )
+
+    assert destination_file_replacement.get_differences(max_input_size=8) == [
+        f"Differences between {existent_path} and {destination_file_replacement.tmp_path} not shown, as their size exceeds 8 characters."
+    ]
+
+
+def test_destination_file_replacement_differences_line_endings_changed(
+    queue: Queue, existent_path: str
+) -> None:
+    with open(existent_path, "w", newline="") as f:
+        f.write(CONTENTS.replace("\n", "\r\n"))
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=existent_path
+    )
+
+    assert destination_file_replacement.differences == [
+        f"--- {existent_path}",
+        f"+++ {destination_file_replacement.tmp_path}",
+        "@@ -1 +1 @@",
+        "-foobar\r",
+        "+foobar",
+    ]
+
+
+def test_destination_file_replacement_differences_encrypted_too_large_not_decrypts(
+    mocker: MockerFixture,
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(encryption_properties, "foobaz\n"))
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=encryption_properties,
+    )
+
+    spy = mocker.spy(_DestinationFile, "decrypt")
+
+    assert destination_file_replacement.get_differences(max_input_size=8) == [
+        f"Differences between {non_existent_path} and {destination_file_replacement.tmp_path} not shown, as their size exceeds 8 characters."
+    ]
+
+    spy.assert_not_called()
+
+
+def test_destination_file_replacement_differences_encrypted(
+    queue: Queue,
+    non_existent_path: str,
+    encryption_properties: EncryptionProperties,
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(encrypt_file(encryption_properties, "foobaz\n"))
+
+    destination_file_replacement = DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        encryption_properties=encryption_properties,
+    )
+
+    assert destination_file_replacement.get_differences(context_lines=0) == [
+        f"--- {non_existent_path}",
+        f"+++ {destination_file_replacement.tmp_path}",
+        "@@ -1 +1 @@",
+        "-foobaz",
+        "+foobar",
+    ]
+
+
+# DestinationFileReplacement: delta
+
+
+def test_destination_file_replacement_delta_copy_item_in_queue(
+    queue: Queue, non_existent_path: str
+) -> None:
+    DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=non_existent_path, delta=True
+    ).add_to_queue()
+
+    assert any(
+        isinstance(item_mapping.item, DeltaCopyItem)
+        for item_mapping in queue.item_mappings
+    )
+
+
+def test_destination_file_replacement_not_delta_copy_item_in_queue(
+    queue: Queue, non_existent_path: str
+) -> None:
+    DestinationFileReplacement(
+        queue, contents=CONTENTS, destination_file_path=non_existent_path
+    ).add_to_queue()
+
+    assert not any(
+        isinstance(item_mapping.item, DeltaCopyItem)
+        for item_mapping in queue.item_mappings
+    )
+
+
+# DestinationFileReplacement: command_scheduler
+
+
+def test_destination_file_replacement_command_scheduler(
+    queue: Queue, non_existent_path: str
+) -> None:
+    command_scheduler = CommandScheduler(queue)
+
+    DestinationFileReplacement(
+        queue,
+        contents=CONTENTS,
+        destination_file_path=non_existent_path,
+        command=COMMAND,
+        reference="test",
+        command_scheduler=command_scheduler,
+    ).add_to_queue()
+
+    assert not any(
+        isinstance(item_mapping.item, CommandItem)
+        for item_mapping in queue.item_mappings
+    )
+
+    command_scheduler.add_to_queue()
+
+    assert queue.item_mappings[-1].item == ConcurrentCommandsItem(
+        commands=[("test", COMMAND)]
+    )
+
+
 # DestinationFileReplacement: reference
 
 
@@ -424,3 +1092,48 @@ def test_destination_file_replacement_reference_passed(
 
     for item_mapping in queue.item_mappings:
         assert item_mapping.item.reference == REFERENCE
+
+
+# DestinationFileReplacement: threads
+
+
+def test_destination_file_replacement_add_to_queue_threads(
+    mocker: MockerFixture, queue: Queue, existent_path: str
+) -> None:
+    add = queue.add
+
+    def _add(*args: Any, **kwargs: Any) -> None:
+        time.sleep(0.001)  # Let other threads run in between
+
+        add(*args, **kwargs)
+
+    mocker.patch.object(queue, "add", side_effect=_add)
+
+    def _add_to_queue(reference: str) -> None:
+        DestinationFileReplacement(
+            queue,
+            contents=reference + "\n",
+            destination_file_path=existent_path,
+            command=COMMAND + [reference],
+            reference=reference,
+        ).add_to_queue()
+
+    threads = [threading.Thread(target=_add_to_queue, args=(str(i),)) for i in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    items = [item_mapping.item for item_mapping in queue.item_mappings]
+
+    assert len(items) == 8 * 3
+
+    for i in range(0, len(items), 3):
+        assert [type(item) for item in items[i : i + 3]] == [
+            CopyItem,
+            CommandItem,
+            UnlinkItem,
+        ]
+        assert len({item.reference for item in items[i : i + 3]}) == 1
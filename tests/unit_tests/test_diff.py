@@ -0,0 +1,157 @@
+import difflib
+from typing import List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cyberfusion.FileSupport.diff import NO_NEWLINE_MARKER, get_differences
+
+FROMFILE = "a"
+TOFILE = "b"
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("foo\nbar\nbaz\n", "foo\nbaz\n"),
+        ("foo\nbar\n", "foo\nbar\nbaz\n"),
+        ("", "foo\n"),
+        ("foo\n", ""),
+        ("a\nb\nc\nd\ne\nf\ng\nh\ni\nj\n", "a\nB\nc\nd\ne\nf\ng\nh\nI\nj\n"),
+        ("a\nx\ny\nx\nb\n", "a\ny\nx\ny\nb\n"),
+        ("a\nb\nc\nd\n", "a\nc\nb\nd\n"),
+    ],
+)
+def test_get_differences_like_difflib(a: str, b: str) -> None:
+    assert get_differences(a, b, fromfile=FROMFILE, tofile=TOFILE) == list(
+        difflib.unified_diff(
+            a.splitlines(), b.splitlines(), FROMFILE, TOFILE, lineterm=""
+        )
+    )
+
+
+def test_get_differences_not_changed() -> None:
+    assert get_differences("foo\n", "foo\n", fromfile=FROMFILE, tofile=TOFILE) == []
+
+
+@pytest.mark.parametrize(
+    "a, b, expected_lines",
+    [
+        ("foo", "foo\n", ["@@ -1 +1 @@", "-foo", NO_NEWLINE_MARKER, "+foo"]),
+        ("foo\n", "foo", ["@@ -1 +1 @@", "-foo", "+foo", NO_NEWLINE_MARKER]),
+        (
+            "foo\nbar",
+            "foo\nbaz",
+            [
+                "@@ -1,2 +1,2 @@",
+                " foo",
+                "-bar",
+                NO_NEWLINE_MARKER,
+                "+baz",
+                NO_NEWLINE_MARKER,
+            ],
+        ),
+        (
+            "foo\nbar",
+            "baz\nbar",
+            ["@@ -1,2 +1,2 @@", "-foo", "+baz", " bar", NO_NEWLINE_MARKER],
+        ),
+        (
+            "foo\r\nbar\n",
+            "foo\nbar\n",
+            ["@@ -1,2 +1,2 @@", "-foo\r", "+foo", " bar"],
+        ),
+    ],
+)
+def test_get_differences_line_endings_changed(
+    a: str, b: str, expected_lines: List[str]
+) -> None:
+    assert (
+        get_differences(a, b, fromfile=FROMFILE, tofile=TOFILE)
+        == [f"--- {FROMFILE}", f"+++ {TOFILE}"] + expected_lines
+    )
+
+
+def test_get_differences_context_lines() -> None:
+    assert get_differences(
+        "a\nb\nc\n", "a\nB\nc\n", fromfile=FROMFILE, tofile=TOFILE, context_lines=0
+    ) == [f"--- {FROMFILE}", f"+++ {TOFILE}", "@@ -2 +2 @@", "-b", "+B"]
+
+
+def test_get_differences_max_input_size() -> None:
+    assert get_differences(
+        "foo\n", "bar\n", fromfile=FROMFILE, tofile=TOFILE, max_input_size=7
+    ) == [
+        f"Differences between {FROMFILE} and {TOFILE} not shown, as their size exceeds 7 characters."
+    ]
+
+
+def test_get_differences_max_output_lines() -> None:
+    assert get_differences(
+        "a\nb\nc\nd\ne\nf\ng\nh\ni\nj\n",
+        "A\nb\nc\nd\ne\nf\ng\nh\ni\nJ\n",
+        fromfile=FROMFILE,
+        tofile=TOFILE,
+        context_lines=0,
+        max_output_lines=5,
+    ) == [
+        f"--- {FROMFILE}",
+        f"+++ {TOFILE}",
+        "@@ -1 +1 @@",
+        "-a",
+        "+A",
+        "Further differences not shown, as they exceed 5 lines.",
+    ]
+
+
+def test_get_differences_large_region_without_unique_lines_replaced(
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch("cyberfusion.FileSupport.diff.SMALL_REGION_SIZE", 0)
+
+    assert get_differences(
+        "a\nx\ny\nx\nb\n", "a\ny\nx\ny\nb\n", fromfile=FROMFILE, tofile=TOFILE
+    ) == [
+        f"--- {FROMFILE}",
+        f"+++ {TOFILE}",
+        "@@ -1,5 +1,5 @@",
+        " a",
+        "-x",
+        "-y",
+        "-x",
+        "+y",
+        "+x",
+        "+y",
+        " b",
+    ]
+
+
+def test_get_differences_budget_exhausted_replaced(mocker: MockerFixture) -> None:
+    mocker.patch("cyberfusion.FileSupport.diff.WORK_FACTOR", 0)
+
+    assert get_differences(
+        "a\nb\nc\nd\n", "a\nc\nb\nd\n", fromfile=FROMFILE, tofile=TOFILE
+    ) == [
+        f"--- {FROMFILE}",
+        f"+++ {TOFILE}",
+        "@@ -1,4 +1,4 @@",
+        " a",
+        "-b",
+        "-c",
+        "+c",
+        "+b",
+        " d",
+    ]
+
+
+def test_get_differences_large_contents_linear() -> None:
+    a = "".join(f"line {i}\n" for i in range(100_000))
+    b = a.replace("line 50000\n", "changed\n")
+
+    assert get_differences(a, b, fromfile=FROMFILE, tofile=TOFILE, context_lines=0) == [
+        f"--- {FROMFILE}",
+        f"+++ {TOFILE}",
+        "@@ -50001 +50001 @@",
+        "-line 50000",
+        "+changed",
+    ]
@@ -1,6 +1,22 @@
+import asyncio
+import dataclasses
+import hashlib
+import io
+import struct
+import subprocess
+import threading
+
 import pytest
+from pytest_mock import MockerFixture
 
 from cyberfusion.FileSupport import EncryptionProperties, encrypt_file, decrypt_file
+from cyberfusion.FileSupport import encryption
+from cyberfusion.FileSupport.encryption import (
+    MessageDigestEnum,
+    async_decrypt_file,
+    async_encrypt_file,
+    compare_file,
+)
 from cyberfusion.FileSupport.exceptions import EncryptionError, DecryptionError
 
 
@@ -18,3 +34,550 @@ def test_decrypt_file_error(
 ) -> None:
     with pytest.raises(DecryptionError):
         decrypt_file(encryption_properties, path=non_existent_path)
+
+
+def test_async_encrypt_file_error(
+    encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    encryption_properties.password_file_path = non_existent_path
+
+    with pytest.raises(EncryptionError):
+        asyncio.run(async_encrypt_file(encryption_properties, contents="foobar"))
+
+
+def test_async_decrypt_file_error(
+    encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    with pytest.raises(DecryptionError):
+        asyncio.run(async_decrypt_file(encryption_properties, path=non_existent_path))
+
+
+def test_async_encrypt_file_not_reads_password_in_event_loop(
+    mocker: MockerFixture, encryption_properties: EncryptionProperties
+) -> None:
+    thread_idents = []
+
+    get_password = encryption.KEY_CACHE.get_password
+
+    def _get_password(path: str) -> bytes:
+        thread_idents.append(threading.get_ident())
+
+        return get_password(path)
+
+    mocker.patch.object(encryption.KEY_CACHE, "get_password", side_effect=_get_password)
+
+    asyncio.run(async_encrypt_file(encryption_properties, "foobar\n"))
+
+    assert thread_idents
+    assert threading.get_ident() not in thread_idents  # Event loop thread
+
+
+def test_async_encrypt_file_async_decrypt_file(
+    encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    with open(non_existent_path, "wb") as f:
+        f.write(asyncio.run(async_encrypt_file(encryption_properties, "foobar\n")))
+
+    assert decrypt_file(encryption_properties, non_existent_path) == "foobar\n"
+    assert (
+        asyncio.run(async_decrypt_file(encryption_properties, non_existent_path))
+        == "foobar\n"
+    )
+
+
+# Chunked format
+
+CONTENTS = "foobar\nfoobaz\n"  # Spans multiple segments
+
+
+def _write(path: str, contents: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(contents)
+
+
+def test_chunked_encrypt_file_decrypt_file(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    assert decrypt_file(chunked_encryption_properties, non_existent_path) == CONTENTS
+
+
+def test_chunked_encrypt_file_decrypt_file_empty(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, ""))
+
+    assert decrypt_file(chunked_encryption_properties, non_existent_path) == ""
+
+
+def test_chunked_async_encrypt_file_async_decrypt_file(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(
+        non_existent_path,
+        asyncio.run(async_encrypt_file(chunked_encryption_properties, CONTENTS)),
+    )
+
+    assert (
+        asyncio.run(
+            async_decrypt_file(chunked_encryption_properties, non_existent_path)
+        )
+        == CONTENTS
+    )
+
+
+def test_chunked_encrypt_file_error(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    chunked_encryption_properties.password_file_path = non_existent_path
+
+    with pytest.raises(EncryptionError):
+        encrypt_file(chunked_encryption_properties, contents=CONTENTS)
+
+
+def test_chunked_decrypt_file_error(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    with pytest.raises(DecryptionError):
+        decrypt_file(chunked_encryption_properties, path=non_existent_path)
+
+
+def test_chunked_decrypt_file_not_chunked_format(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, b"x" * 64)
+
+    with pytest.raises(DecryptionError, match="File is not in chunked format."):
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+
+
+def test_chunked_decrypt_file_too_small(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, b"x")
+
+    with pytest.raises(
+        DecryptionError, match="File is too small to be in chunked format."
+    ):
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+
+
+def test_chunked_decrypt_file_truncated(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(
+        non_existent_path, encrypt_file(chunked_encryption_properties, CONTENTS)[:-40]
+    )
+
+    with pytest.raises(DecryptionError, match="File is truncated."):
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+
+
+def test_chunked_decrypt_file_segment_removed(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+
+    _write(non_existent_path, contents[: -(16 + 2 + 32)])  # Last segment is 2 bytes
+
+    # Segment 2 is now the last segment, but its tag says otherwise
+
+    with pytest.raises(DecryptionError, match="Authenticating segment 2 failed."):
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+
+
+def test_chunked_decrypt_file_segment_changed(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    contents = bytearray(encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    contents[32 + 16] ^= 1  # First byte of ciphertext of first segment
+
+    _write(non_existent_path, bytes(contents))
+
+    with pytest.raises(DecryptionError, match="Authenticating segment 0 failed."):
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+
+
+def test_chunked_decrypt_file_segment_from_other_file(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+    other_contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+
+    # Files have the same master key, but keys differ by their salts
+
+    segment_length = 16 + 4 + 32
+
+    _write(
+        non_existent_path,
+        contents[:32]
+        + other_contents[32 : 32 + segment_length]
+        + contents[32 + segment_length :],
+    )
+
+    with pytest.raises(DecryptionError, match="Authenticating segment 0 failed."):
+        decrypt_file(chunked_encryption_properties, non_existent_path)
+
+
+def test_chunked_encrypt_file_previous_path_reuses_unchanged_segments(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    previous_contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+
+    _write(non_existent_path, previous_contents)
+
+    contents = encrypt_file(
+        chunked_encryption_properties,
+        CONTENTS.replace("foobaz", "foobax"),
+        previous_path=non_existent_path,
+    )
+
+    # Header and the first three segments are reused, the last segment ('x\n'
+    # instead of 'z\n') is not.
+
+    segment_length = 16 + 4 + 32
+
+    assert len(contents) == len(previous_contents)
+    assert (
+        contents[: 32 + 3 * segment_length]
+        == previous_contents[: 32 + 3 * segment_length]
+    )
+    assert (
+        contents[32 + 3 * segment_length :]
+        != previous_contents[32 + 3 * segment_length :]
+    )
+
+    _write(non_existent_path, contents)
+
+    assert decrypt_file(
+        chunked_encryption_properties, non_existent_path
+    ) == CONTENTS.replace("foobaz", "foobax")
+
+
+def test_chunked_encrypt_file_previous_path_not_reuses_last_segment(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, "foob"))
+
+    contents = encrypt_file(
+        chunked_encryption_properties, "foobar", previous_path=non_existent_path
+    )
+
+    _write(non_existent_path, contents)
+
+    assert decrypt_file(chunked_encryption_properties, non_existent_path) == "foobar"
+
+
+def test_chunked_encrypt_file_previous_path_other_password(
+    chunked_encryption_properties: EncryptionProperties,
+    non_existent_path: str,
+    existent_path: str,
+) -> None:
+    _write(existent_path, b"other")
+
+    other_encryption_properties = dataclasses.replace(
+        chunked_encryption_properties, password_file_path=existent_path
+    )
+
+    _write(non_existent_path, encrypt_file(other_encryption_properties, CONTENTS))
+
+    contents = encrypt_file(
+        chunked_encryption_properties, CONTENTS, previous_path=non_existent_path
+    )
+
+    _write(non_existent_path, contents)
+
+    assert decrypt_file(chunked_encryption_properties, non_existent_path) == CONTENTS
+
+
+@pytest.mark.parametrize(
+    "previous_contents",
+    [
+        b"not chunked",
+        b"CFFSENC1" + struct.pack(">II", 8, 1000) + b"s" * 16 + b"x" * 56,
+    ],
+)
+def test_chunked_encrypt_file_previous_path_not_reusable(
+    chunked_encryption_properties: EncryptionProperties,
+    non_existent_path: str,
+    previous_contents: bytes,
+) -> None:
+    _write(non_existent_path, previous_contents)
+
+    contents = encrypt_file(
+        chunked_encryption_properties, CONTENTS, previous_path=non_existent_path
+    )
+
+    assert contents[:8] == b"CFFSENC1"
+    assert contents[16:32] != previous_contents[16:32]
+
+
+def test_chunked_compare_file_equal(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    assert compare_file(chunked_encryption_properties, non_existent_path, CONTENTS)
+
+
+def test_chunked_compare_file_not_equal(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    assert not compare_file(
+        chunked_encryption_properties,
+        non_existent_path,
+        CONTENTS.replace("foobar", "foobax"),
+    )
+
+
+def test_chunked_compare_file_size_not_equal_not_decrypts(
+    mocker: MockerFixture,
+    chunked_encryption_properties: EncryptionProperties,
+    non_existent_path: str,
+) -> None:
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    spy = mocker.spy(encryption, "_derive_keys")
+
+    assert not compare_file(
+        chunked_encryption_properties, non_existent_path, CONTENTS + "-example"
+    )
+
+    spy.assert_not_called()
+
+
+def test_chunked_compare_file_error(
+    chunked_encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    with pytest.raises(DecryptionError):
+        compare_file(chunked_encryption_properties, non_existent_path, CONTENTS)
+
+
+def test_compare_file(
+    encryption_properties: EncryptionProperties, non_existent_path: str
+) -> None:
+    _write(non_existent_path, encrypt_file(encryption_properties, CONTENTS))
+
+    assert compare_file(encryption_properties, non_existent_path, CONTENTS)
+    assert not compare_file(encryption_properties, non_existent_path, "foobar\n")
+
+
+# Key cache
+
+
+def test_key_cache_get_password_caches(
+    mocker: MockerFixture, encryption_password: str, existent_path: str
+) -> None:
+    password = encryption_password.strip().encode()
+
+    _write(existent_path, password + b"\nfoobar\n")
+
+    key_cache = encryption.KeyCache()
+
+    spy = mocker.patch("builtins.open", side_effect=open)
+
+    assert key_cache.get_password(existent_path) == password
+    assert key_cache.get_password(existent_path) == password
+
+    spy.assert_called_once()
+
+
+def test_key_cache_get_password_keeps_carriage_return(
+    encryption_password_file_path: str, existent_path: str, non_existent_path: str
+) -> None:
+    # Password files with CRLF line endings must be read like OpenSSL's
+    # '-pass file:' does, which only strips the newline
+
+    _write(existent_path, b"secret\r\n")
+
+    encryption_properties = EncryptionProperties(
+        cipher_name="aes-256-cbc",
+        message_digest=MessageDigestEnum.SHA1,
+        password_file_path=existent_path,
+    )
+
+    _write(
+        non_existent_path,
+        subprocess.check_output(
+            [
+                "openssl",
+                "enc",
+                "-aes-256-cbc",
+                "-md",
+                "sha1",
+                "-pass",
+                "file:" + existent_path,
+            ],
+            input=b"foobar\n",
+        ),
+    )
+
+    assert encryption.KeyCache().get_password(existent_path) == b"secret\r"
+    assert decrypt_file(encryption_properties, non_existent_path) == "foobar\n"
+
+
+def test_key_cache_get_master_key_caches(
+    mocker: MockerFixture, encryption_password_file_path: str
+) -> None:
+    key_cache = encryption.KeyCache()
+
+    spy = mocker.spy(encryption.hashlib, "pbkdf2_hmac")
+
+    master_key = key_cache.get_master_key(encryption_password_file_path, 1000)
+
+    assert key_cache.get_master_key(encryption_password_file_path, 1000) == master_key
+    assert key_cache.get_master_key(encryption_password_file_path, 1001) != master_key
+
+    assert spy.call_count == 2
+
+
+def test_key_cache_password_file_changed(
+    existent_path: str,
+) -> None:
+    key_cache = encryption.KeyCache()
+
+    _write(existent_path, b"foobar")
+
+    master_key = key_cache.get_master_key(existent_path, 1000)
+
+    password = key_cache._passwords[existent_path]
+
+    _write(existent_path, b"foobaz-example")
+
+    assert key_cache.get_password(existent_path) == b"foobaz-example"
+    assert key_cache.get_master_key(existent_path, 1000) != master_key
+
+    assert password == bytearray(6)
+    assert len(key_cache._master_keys) == 1
+
+
+def test_key_cache_get_master_key_password_file_changed_after_reading(
+    mocker: MockerFixture, existent_path: str
+) -> None:
+    key_cache = encryption.KeyCache()
+
+    _write(existent_path, b"foobar")
+
+    real_open = open
+
+    def _open(path: str, mode: str) -> io.BytesIO:
+        with real_open(path, mode) as f:
+            contents = f.read()
+
+        with real_open(path, "wb") as f:
+            f.write(b"foobaz-example")
+
+        return io.BytesIO(contents)
+
+    mocker.patch("builtins.open", side_effect=_open)
+
+    key_cache.get_master_key(existent_path, 1000)
+
+    mocker.stopall()
+
+    # Key derived from previous password is not used for changed password file
+
+    assert key_cache.get_master_key(existent_path, 1000) == hashlib.pbkdf2_hmac(
+        "sha256", b"foobaz-example", encryption._MASTER_KEY_SALT, 1000
+    )
+
+
+def test_key_cache_evict(encryption_password_file_path: str) -> None:
+    key_cache = encryption.KeyCache()
+
+    key_cache.get_master_key(encryption_password_file_path, 1000)
+
+    password = key_cache._passwords[encryption_password_file_path]
+    (master_key,) = key_cache._master_keys.values()
+
+    key_cache.evict(encryption_password_file_path)
+
+    assert password == bytearray(len(password))
+    assert master_key == bytearray(32)
+    assert not key_cache._master_keys
+    assert not key_cache._passwords
+
+
+def test_key_cache_clear(
+    encryption_password_file_path: str, existent_path: str
+) -> None:
+    key_cache = encryption.KeyCache()
+
+    _write(existent_path, b"foobar")
+
+    key_cache.get_master_key(encryption_password_file_path, 1000)
+    key_cache.get_master_key(existent_path, 1000)
+
+    key_cache.clear()
+
+    assert not key_cache._master_keys
+    assert not key_cache._passwords
+    assert not key_cache._identities
+
+
+def test_key_cache_max_entries(encryption_password_file_path: str) -> None:
+    key_cache = encryption.KeyCache(max_entries=2)
+
+    key_cache.get_master_key(encryption_password_file_path, 1000)
+    key_cache.get_master_key(encryption_password_file_path, 1001)
+
+    (_, oldest_master_key) = key_cache._master_keys.values()
+
+    key_cache.get_master_key(encryption_password_file_path, 1000)  # Most recent
+    key_cache.get_master_key(encryption_password_file_path, 1002)
+
+    assert [key[4] for key in key_cache._master_keys] == [1000, 1002]
+    assert oldest_master_key == bytearray(32)
+
+
+def test_chunked_encrypt_file_random_salt(
+    chunked_encryption_properties: EncryptionProperties,
+) -> None:
+    first_contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+    second_contents = encrypt_file(chunked_encryption_properties, CONTENTS)
+
+    assert first_contents[16:32] != second_contents[16:32]
+
+
+def test_chunked_decrypt_file_derives_master_key_once(
+    mocker: MockerFixture,
+    chunked_encryption_properties: EncryptionProperties,
+    non_existent_path: str,
+    existent_path: str,
+) -> None:
+    # Files created by different processes, i.e. with an empty cache
+
+    _write(non_existent_path, encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    encryption.KEY_CACHE.clear()
+
+    _write(existent_path, encrypt_file(chunked_encryption_properties, CONTENTS))
+
+    encryption.KEY_CACHE.clear()
+
+    spy = mocker.spy(encryption.hashlib, "pbkdf2_hmac")
+
+    assert decrypt_file(chunked_encryption_properties, non_existent_path) == CONTENTS
+    assert decrypt_file(chunked_encryption_properties, existent_path) == CONTENTS
+
+    spy.assert_called_once()
+
+
+def test_encrypt_file_not_exposes_password(
+    mocker: MockerFixture,
+    encryption_properties: EncryptionProperties,
+    encryption_password: str,
+) -> None:
+    spy = mocker.spy(encryption.subprocess, "check_output")
+
+    encrypt_file(encryption_properties, contents="foobar")
+
+    assert not any(
+        encryption_properties.password_file_path in argument
+        or encryption_password in argument
+        for argument in spy.call_args.args[0]
+    )
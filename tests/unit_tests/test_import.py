@@ -0,0 +1,77 @@
+import subprocess
+import sys
+
+import pytest
+
+import cyberfusion.FileSupport
+from cyberfusion.FileSupport.encryption import EncryptionProperties
+
+# The import time budget is relative to importing a standard library module in
+# the same process, as absolute import times vary with the load of the machine.
+# Importing the package takes about as long as importing the baseline module.
+# Importing asyncio eagerly would take about 7 times as long, importing
+# cyberfusion.Common or QueueSupport eagerly about 20 to 100 times.
+
+BASELINE_MODULE = "email.parser"
+IMPORT_TIME_BUDGET_FACTOR = 3
+
+LAZY_MODULES = [
+    "asyncio",
+    "cyberfusion.Common",
+    "cyberfusion.QueueSupport",
+    "cyberfusion.FileSupport.encryption",
+    "cyberfusion.FileSupport.items",
+    "cyberfusion.FileSupport.scheduler",
+]
+
+
+def test_import_time_within_budget() -> None:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import cyberfusion.FileSupport, {BASELINE_MODULE}",
+        ],
+        check=True,
+        text=True,
+        stderr=subprocess.PIPE,
+    ).stderr
+
+    import_times = {
+        line.split("|")[2].strip(): int(line.split("|")[1])
+        for line in output.splitlines()[1:]
+    }
+
+    assert (
+        import_times["cyberfusion.FileSupport"]
+        < IMPORT_TIME_BUDGET_FACTOR * import_times[BASELINE_MODULE]
+    )
+
+
+def test_import_not_imports_lazy_modules() -> None:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, cyberfusion.FileSupport; print('\\n'.join(sys.modules))",
+        ],
+        check=True,
+        text=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+
+    assert not set(LAZY_MODULES) & set(output.splitlines())
+
+
+def test_lazy_attribute() -> None:
+    assert cyberfusion.FileSupport.EncryptionProperties is EncryptionProperties
+
+
+def test_lazy_attribute_not_exists() -> None:
+    with pytest.raises(
+        AttributeError,
+        match="module 'cyberfusion.FileSupport' has no attribute 'example'",
+    ):
+        cyberfusion.FileSupport.example
@@ -0,0 +1,215 @@
+import os
+from pathlib import Path
+
+import pytest
+from cyberfusion.Common import get_tmp_file
+from cyberfusion.QueueSupport.exceptions import CommandQueueFulfillFailed
+
+from cyberfusion.FileSupport.items import ConcurrentCommandsItem, DeltaCopyItem
+
+BLOCK_SIZE = 4
+
+
+def test_delta_copy_item_write_changed_blocks_only_changed(existent_path: str) -> None:
+    source = get_tmp_file()
+
+    with open(existent_path, "w") as f:
+        f.write("aaaabbbbcccc")
+
+    with open(source, "w") as f:
+        f.write("aaaaXbbbcccc")
+
+    assert (
+        DeltaCopyItem(
+            source=source, destination=existent_path, block_size=BLOCK_SIZE
+        )._write_changed_blocks()
+        == 1
+    )
+
+    assert open(existent_path, "r").read() == "aaaaXbbbcccc"
+
+
+def test_delta_copy_item_write_changed_blocks_appended(existent_path: str) -> None:
+    source = get_tmp_file()
+
+    with open(existent_path, "w") as f:
+        f.write("aaaabbbb")
+
+    with open(source, "w") as f:
+        f.write("aaaabbbbcc")
+
+    assert (
+        DeltaCopyItem(
+            source=source, destination=existent_path, block_size=BLOCK_SIZE
+        )._write_changed_blocks()
+        == 1
+    )
+
+    assert open(existent_path, "r").read() == "aaaabbbbcc"
+
+
+def test_delta_copy_item_write_changed_blocks_truncated(existent_path: str) -> None:
+    source = get_tmp_file()
+
+    with open(existent_path, "w") as f:
+        f.write("aaaabbbbcccc")
+
+    with open(source, "w") as f:
+        f.write("aaaab")
+
+    assert (
+        DeltaCopyItem(
+            source=source, destination=existent_path, block_size=BLOCK_SIZE
+        )._write_changed_blocks()
+        == 0
+    )
+
+    assert open(existent_path, "r").read() == "aaaab"
+
+
+def test_delta_copy_item_fulfill_destination_not_exists(
+    non_existent_path: str,
+) -> None:
+    source = get_tmp_file()
+
+    with open(source, "w") as f:
+        f.write("foobar\n")
+
+    outcomes = DeltaCopyItem(source=source, destination=non_existent_path).fulfill()
+
+    assert len(outcomes) == 1
+
+    assert open(non_existent_path, "r").read() == "foobar\n"
+
+
+def test_delta_copy_item_fulfill_destination_exists(existent_path: str) -> None:
+    source = get_tmp_file()
+
+    with open(existent_path, "w") as f:
+        f.write("foobar\n")
+
+    with open(source, "w") as f:
+        f.write("foobaz\n")
+
+    outcomes = DeltaCopyItem(source=source, destination=existent_path).fulfill()
+
+    assert outcomes[0].changed_lines == [
+        f"--- {source}",
+        f"+++ {existent_path}",
+        "@@ -1 +1 @@",
+        "-foobar\n",
+        "+foobaz\n",
+    ]
+
+    assert open(existent_path, "r").read() == "foobaz\n"
+
+
+def test_delta_copy_item_fulfill_not_changed(existent_path: str) -> None:
+    source = get_tmp_file()
+
+    with open(existent_path, "w") as f:
+        f.write("foobar\n")
+
+    with open(source, "w") as f:
+        f.write("foobar\n")
+
+    assert DeltaCopyItem(source=source, destination=existent_path).fulfill() == []
+
+
+# ConcurrentCommandsItem
+
+
+def test_concurrent_commands_item_outcomes() -> None:
+    outcomes = ConcurrentCommandsItem(
+        commands=[("a", ["true"]), (None, ["false"])]
+    ).outcomes
+
+    assert [(outcome.key, outcome.command) for outcome in outcomes] == [
+        ("a", ["true"]),
+        (None, ["false"]),
+    ]
+
+
+def test_concurrent_commands_item_fulfill() -> None:
+    outcomes = ConcurrentCommandsItem(commands=[(None, ["echo", "foobar"])]).fulfill()
+
+    assert outcomes[0].stdout == "foobar\n"
+    assert outcomes[0].stderr == ""
+    assert outcomes[0].duration is not None
+
+
+def test_concurrent_commands_item_fulfill_concurrently(tmp_path: Path) -> None:
+    # Every command creates a marker, then waits until all markers exist. This
+    # only finishes when all commands run at the same time. The timeout only
+    # prevents hanging when they don't.
+
+    ConcurrentCommandsItem(
+        commands=[
+            (
+                str(i),
+                [
+                    "timeout",
+                    "10",
+                    "sh",
+                    "-c",
+                    f"touch {tmp_path}/{i}; until [ $(ls {tmp_path} | wc -l) -eq 4 ]; do sleep 0.01; done",
+                ],
+            )
+            for i in range(4)
+        ],
+        concurrency=4,
+    ).fulfill()
+
+
+def test_concurrent_commands_item_fulfill_same_key_serialised(
+    non_existent_path: str,
+) -> None:
+    ConcurrentCommandsItem(
+        commands=[
+            ("a", ["sh", "-c", f"sleep 0.2; echo 1 >> {non_existent_path}"]),
+            ("a", ["sh", "-c", f"echo 2 >> {non_existent_path}"]),
+        ],
+        concurrency=2,
+    ).fulfill()
+
+    assert open(non_existent_path, "r").read() == "1\n2\n"
+
+
+def test_concurrent_commands_item_fulfill_failed(non_existent_path: str) -> None:
+    item = ConcurrentCommandsItem(
+        commands=[
+            ("a", ["sh", "-c", "echo foo; echo bar >&2; false"]),
+            ("a", ["touch", non_existent_path + "-a"]),
+            ("b", ["touch", non_existent_path + "-b"]),
+        ],
+    )
+
+    with pytest.raises(CommandQueueFulfillFailed) as e:
+        item.fulfill()
+
+    assert e.value.item == item
+    assert e.value.stdout == "foo\n"
+    assert e.value.stderr == "bar\n"
+
+    assert not os.path.exists(non_existent_path + "-a")
+    assert os.path.exists(non_existent_path + "-b")
+
+    os.unlink(non_existent_path + "-b")
+
+
+def test_concurrent_commands_item_equal() -> None:
+    assert ConcurrentCommandsItem(commands=[("a", ["true"])]) == ConcurrentCommandsItem(
+        commands=[("a", ["true"])], concurrency=2
+    )
+    assert hash(ConcurrentCommandsItem(commands=[("a", ["true"])])) == hash(
+        ConcurrentCommandsItem(commands=[("a", ["true"])])
+    )
+
+
+def test_concurrent_commands_item_not_equal() -> None:
+    assert ConcurrentCommandsItem(commands=[("a", ["true"])]) != ConcurrentCommandsItem(
+        commands=[("a", ["false"])]
+    )
+    assert ConcurrentCommandsItem(commands=[("a", ["true"])]) != DeltaCopyItem(
+        source="/tmp/a", destination="/tmp/b"
+    )
@@ -0,0 +1,12 @@
+from cyberfusion.FileSupport.outcomes import CommandItemTimedRunOutcome
+
+
+def test_command_item_timed_run_outcome_string_without_duration() -> None:
+    assert str(CommandItemTimedRunOutcome(command=["true"])) == "Run ['true']"
+
+
+def test_command_item_timed_run_outcome_string_with_duration() -> None:
+    assert (
+        str(CommandItemTimedRunOutcome(command=["true"], duration=1.5))
+        == "Run ['true'] (took 1.50s)"
+    )
@@ -0,0 +1,92 @@
+import warnings
+from typing import List, Optional
+
+import pytest
+
+from cyberfusion.QueueSupport import Queue
+
+from cyberfusion.FileSupport.items import ConcurrentCommandsItem
+from cyberfusion.FileSupport.scheduler import CommandScheduler
+
+
+def test_command_scheduler_add_to_queue(queue: Queue) -> None:
+    command_scheduler = CommandScheduler(queue, concurrency=2)
+
+    command_scheduler.add(["true"], reference="a")
+    command_scheduler.add(["false"])
+
+    command_scheduler.add_to_queue()
+
+    assert len(queue.item_mappings) == 1
+
+    item = queue.item_mappings[0].item
+
+    assert item == ConcurrentCommandsItem(commands=[("a", ["true"]), (None, ["false"])])
+    assert item.concurrency == 2
+
+
+def test_command_scheduler_add_to_queue_clears(queue: Queue) -> None:
+    command_scheduler = CommandScheduler(queue)
+
+    command_scheduler.add(["true"])
+    command_scheduler.add_to_queue()
+    command_scheduler.add_to_queue()
+
+    assert len(queue.item_mappings) == 1
+
+
+def test_command_scheduler_add_to_queue_no_commands(queue: Queue) -> None:
+    CommandScheduler(queue).add_to_queue()
+
+    assert queue.item_mappings == []
+
+
+def test_command_scheduler_add_duplicate(queue: Queue) -> None:
+    command_scheduler = CommandScheduler(queue)
+
+    command_scheduler.add(["true"], reference="a")
+    command_scheduler.add(["true"], reference="b")
+    command_scheduler.add_to_queue()
+
+    assert queue.item_mappings[0].item == ConcurrentCommandsItem(
+        commands=[("a", ["true"])]
+    )
+
+
+def test_command_scheduler_key(queue: Queue) -> None:
+    def _get_service(command: List[str], reference: Optional[str]) -> Optional[str]:
+        return command[-1]
+
+    command_scheduler = CommandScheduler(queue, key=_get_service)
+
+    command_scheduler.add(["systemctl", "reload", "nginx"], reference="a")
+    command_scheduler.add_to_queue()
+
+    assert queue.item_mappings[0].item == ConcurrentCommandsItem(
+        commands=[("nginx", ["systemctl", "reload", "nginx"])]
+    )
+
+
+def test_command_scheduler_warns_when_commands_not_added_to_queue(
+    queue: Queue,
+) -> None:
+    command_scheduler = CommandScheduler(queue)
+
+    command_scheduler.add(["true"])
+
+    with pytest.warns(RuntimeWarning, match="1 command\\(s\\) not added"):
+        del command_scheduler
+
+
+def test_command_scheduler_not_warns_when_commands_added_to_queue(
+    queue: Queue,
+) -> None:
+    command_scheduler = CommandScheduler(queue)
+
+    command_scheduler.add(["true"])
+    command_scheduler.add_to_queue()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+
+        del command_scheduler
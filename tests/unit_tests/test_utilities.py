@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+from typing import Any
+
+from cyberfusion.QueueSupport import Queue
+from cyberfusion.QueueSupport.items.command import CommandItem
+from pytest_mock import MockerFixture
+
+from cyberfusion.FileSupport.utilities import (
+    add_items_to_queue,
+    gather_with_concurrency,
+    get_queue_lock,
+)
+
+
+def test_gather_with_concurrency() -> None:
+    running = 0
+    max_running = 0
+
+    async def _sleep(result: int) -> int:
+        nonlocal running, max_running
+
+        running += 1
+        max_running = max(max_running, running)
+
+        await asyncio.sleep(0.01 * (5 - result))
+
+        running -= 1
+
+        return result
+
+    assert asyncio.run(
+        gather_with_concurrency([_sleep(i) for i in range(5)], concurrency=2)
+    ) == [0, 1, 2, 3, 4]
+
+    assert max_running == 2
+
+
+def test_get_queue_lock(queue: Queue) -> None:
+    assert get_queue_lock(queue) is get_queue_lock(queue)
+    assert get_queue_lock(queue) is not get_queue_lock(Queue())
+
+
+def test_add_items_to_queue_atomically(mocker: MockerFixture, queue: Queue) -> None:
+    add = queue.add
+
+    def _add(*args: Any, **kwargs: Any) -> None:
+        time.sleep(0.001)  # Let other threads run in between
+
+        add(*args, **kwargs)
+
+    mocker.patch.object(queue, "add", side_effect=_add)
+
+    threads = [
+        threading.Thread(
+            target=add_items_to_queue,
+            args=(
+                queue,
+                [
+                    CommandItem(command=["true", str(i), str(j)], reference=str(i))
+                    for j in range(5)
+                ],
+            ),
+        )
+        for i in range(8)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    references = [item_mapping.item.reference for item_mapping in queue.item_mappings]
+
+    assert len(references) == 40
+
+    for i in range(0, 40, 5):
+        assert len(set(references[i : i + 5])) == 1